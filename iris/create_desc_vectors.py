@@ -2,8 +2,9 @@
 import connect
 import pandas as pd
 import json 
+import sqlalchemy as sa
 from sqlalchemy import create_engine, text
-from time import sleep
+from time import perf_counter, sleep
 import os 
 import iris
 
@@ -13,6 +14,8 @@ model_dir = "/home/irisowner/dev"
 model_name = "sentence-transformers/all-MiniLM-L6-v2"
 fields_to_vectorize = ['DESCRIPTION_OBSERVATIONS', 'DESCRIPTION_PROCEDURES', 'DESCRIPTION_MEDICATIONS', 'DESCRIPTION_CONDITIONS', 'CLINICAL_NOTES']
 app_namespace = 'IRISAPP'
+# Index maps of GenAI.encounters (src/GenAI/encounters.cls) that a %NOINDEX load leaves stale
+index_maps = ['NotesIndex', 'DDLBEIndex']
 
 # TODO - use fields_to_vectorize
 new_cols = [
@@ -32,6 +35,118 @@ del_cols = [
 ]
 
 
+# Columns of GenAI.encounters as declared in src/GenAI/encounters.cls, in SqlColumnNumber order
+# (the _Vector columns are added by update_columns)
+encounter_column_types = {
+    'ENCOUNTER_ID': sa.BigInteger(),
+    'CLINICAL_NOTES': sa.String(65535),
+    'BIRTHDATE': sa.String(65535),
+    'FIRST': sa.String(65535),
+    'START': sa.String(65535),
+    'STOP': sa.String(65535),
+    'PATIENT_ID': sa.BigInteger(),
+    'ENCOUNTERCLASS': sa.String(65535),
+    'CODE': sa.BigInteger(),
+    'DESCRIPTION': sa.String(65535),
+    'BASE_ENCOUNTER_COST': sa.Float(),
+    'TOTAL_CLAIM_COST': sa.Float(),
+    'PAYER_COVERAGE': sa.Float(),
+    'REASONCODE': sa.Float(),
+    'REASONDESCRIPTION': sa.String(65535),
+    'PATIENT_AGE': sa.BigInteger(),
+    'DESCRIPTION_OBSERVATIONS': sa.String(65535),
+    'DESCRIPTION_CONDITIONS': sa.String(65535),
+    'DESCRIPTION_MEDICATIONS': sa.String(65535),
+    'DESCRIPTION_PROCEDURES': sa.String(65535),
+}
+
+def encounters_table(name: str = 'encounters', schema: str = 'GenAI') -> sa.Table:
+    return sa.Table(name, sa.MetaData(), *[sa.Column(column, column_type)
+                                           for column, column_type in encounter_column_types.items()], schema=schema)
+
+def typed_rows(data: pd.DataFrame, table: sa.Table) -> list[tuple]:
+    """
+    The table's columns of data as tuples of Python values of the declared types
+
+    BigInt columns become int, Double columns float and String columns str, with None
+    for missing values; columns data does not have are sent as None.
+    """
+    values = []
+    for column in table.columns:
+        if column.name not in data:
+            values.append([None] * len(data))
+            continue
+        python_type = column.type.python_type
+        values.append([None if pd.isna(value) else python_type(value) for value in data[column.name].tolist()])
+    return list(zip(*values))
+
+def set_map_selectability(table_name: str, selectable: bool, maps: list = index_maps):
+    """
+    Let the query optimizer use (or not use) the index maps of table_name
+
+    Maps are marked unselectable while rows are inserted with %NOINDEX, so queries run
+    during the load scan the table instead of reading incomplete indices.
+    """
+    for map_name in maps:
+        status = iris.cls('%SYSTEM.SQL.Util').SetMapSelectability(table_name, map_name, int(selectable))
+        if iris.cls('%SYSTEM.Status').IsError(status):
+            raise RuntimeError(f"SetMapSelectability({table_name}, {map_name}, {int(selectable)}) failed: "
+                               f"{iris.cls('%SYSTEM.Status').GetErrorText(status)}")
+
+def rebuild_indices(engine, table_name: str) -> float:
+    """
+    Build all indices of table_name (NotesIndex, the bitmap extent, ...) in one pass,
+    then mark them selectable again
+
+    BUILD INDEX runs %BuildIndices, which splits the work over background jobs when the
+    table is large enough.
+
+    Returns:
+        Seconds spent.
+    """
+    start = perf_counter()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"BUILD INDEX FOR TABLE {table_name}")
+    set_map_selectability(table_name, True)
+    elapsed = perf_counter() - start
+    print(f"Built indices for {table_name} in {elapsed:.1f}s")
+    return elapsed
+
+def bulk_load(data: pd.DataFrame, engine, table: sa.Table = None, batch_size: int = 10_000,
+              build_indices: bool = True) -> float:
+    """
+    Insert data into table (GenAI.encounters by default) with executemany, batch_size rows per call
+
+    Creates the table with the encounters.cls column types if it does not exist. On IRIS the
+    index maps are marked unselectable and the rows inserted with %NOINDEX; the indices are
+    built and made selectable again at the end, unless build_indices is False (then call
+    rebuild_indices after the remaining writes).
+
+    Returns:
+        Seconds spent writing rows (not counting the index build).
+    """
+    table = table if table is not None else encounters_table()
+    table.create(engine, checkfirst=True)
+    is_iris = engine.dialect.name == 'iris'
+    if is_iris:
+        set_map_selectability(table.fullname, False)
+    insert = (f"INSERT {'%NOINDEX ' if is_iris else ''}INTO {table.fullname} "
+              f"({', '.join(column.name for column in table.columns)}) "
+              f"VALUES ({', '.join('?' for _ in table.columns)})")
+
+    start = perf_counter()
+    rows = typed_rows(data, table)
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        for batch_start in range(0, len(rows), batch_size):
+            cursor.executemany(insert, rows[batch_start:batch_start + batch_size])
+    elapsed = perf_counter() - start
+    print(f"Bulk loaded {len(rows)} rows into {table.fullname} in {elapsed:.1f}s ({len(rows) / max(elapsed, 1e-9):.0f} rows/s)")
+
+    if is_iris and build_indices:
+        rebuild_indices(engine, table.fullname)
+    return elapsed
+
 def execute_sql(conn, stmt):
     response = None
     try:
@@ -113,31 +228,53 @@ def load_model():
     model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
     print(f"This is the model that was loaded {model}")
 
-def load_data():
+def load_data(file: str = '/home/irisowner/dev/data/encounters.csv', method: str = 'bulk',
+              build_indices: bool = True):
+    """
+    Load the encounters file into GenAI.<file name>
+
+    method 'bulk' uses bulk_load (executemany in batches, declared column types, indices
+    built after the load, or left to the caller with build_indices=False); 'to_sql' is the
+    previous DataFrame.to_sql load, kept for comparison.
+    """
     
     iris.system.Process.SetNamespace(app_namespace)
 
     # load demo data
     engine = create_engine('iris+emb:///')
-    file = '/home/irisowner/dev/data/encounters.csv'
     table_name = os.path.splitext(os.path.basename(file))[0]
     print(f"tablename {table_name}, filename {file}")
 
-    # load the csv file into a pandas dataframe
-    data = pd.read_csv(file)
+    # load the csv (or parquet, see python/scripts/encounter_io.py) file into a pandas dataframe
+    if file.endswith('.parquet'):
+        data = pd.read_parquet(file)
+    else:
+        data = pd.read_csv(file)
     print(f"Loaded {len(data)} records")
 
     # write the dataframe to IRIS
-    results = data.to_sql(table_name, engine, if_exists='append', index=False, schema="GenAI")
-    print(f"Results: {results}")
+    if method == 'bulk':
+        bulk_load(data, engine, encounters_table(table_name), build_indices=build_indices)
+    else:
+        start = perf_counter()
+        results = data.to_sql(table_name, engine, if_exists='append', index=False, schema="GenAI")
+        elapsed = perf_counter() - start
+        print(f"Results: {results}, {len(data) / max(elapsed, 1e-9):.0f} rows/s with to_sql")
 
     update_columns(add_columns=new_cols)
 
     return data
 
-def vectorize_data(data, table_name):
+def vectorize_data(data, table_name) -> float:
+    """
+    Embed fields_to_vectorize and store them in the _Vector columns, one UPDATE pass per field
+
+    Returns:
+        Seconds spent in the UPDATEs (not counting encoding).
+    """
     
     iris.system.Process.SetNamespace(app_namespace)
+    write_seconds = 0.0
 
     # load demo data
     engine = create_engine('iris+emb:///')
@@ -170,6 +307,7 @@ def vectorize_data(data, table_name):
             #print(batch[vector_col_name].head())
             
             # Update the database with the vector data
+            write_start = perf_counter()
             with engine.connect() as conn:
                 with conn.begin():
                     for index, row in batch.iterrows():
@@ -183,14 +321,41 @@ def vectorize_data(data, table_name):
                                 'vector': str(row[vector_col_name]),
                                 'encounter_id': row['ENCOUNTER_ID']
                             })
+            write_seconds += perf_counter() - write_start
             
             print(f"Processed batch: {start} to {end} of {len(data)} for {col}")
 
-if __name__ == '__main__':
+    return write_seconds
+
+def load_and_vectorize(file: str = '/home/irisowner/dev/data/encounters.csv', defer_indices: bool = True):
+    """
+    load_data, add_embedding_config and vectorize_data, reporting data write vs index build time
 
-    data = load_data()
+    With defer_indices, the rows are inserted without index maintenance (%NOINDEX) while
+    the index maps are unselectable, and the indices are built once after the vector
+    passes with rebuild_indices.
+    """
+    engine = create_engine('iris+emb:///')
+    full_table_name = f"GenAI.{os.path.splitext(os.path.basename(file))[0]}"
+
+    start = perf_counter()
+    data = load_data(file, build_indices=not defer_indices)
+    load_seconds = perf_counter() - start
     add_embedding_config(delete=False)
-    vectorize_data(data, table_name)
+    vector_seconds = vectorize_data(data, full_table_name)
+    index_seconds = rebuild_indices(engine, full_table_name) if defer_indices else 0.0
+
+    print(f"Data writes: {load_seconds + vector_seconds:.1f}s (load {load_seconds:.1f}s, "
+          f"vector updates {vector_seconds:.1f}s)")
+    if defer_indices:
+        print(f"Index build: {index_seconds:.1f}s")
+    else:
+        print("Index maintenance: included in the data writes (defer_indices=False)")
+    return data
+
+if __name__ == '__main__':
+
+    data = load_and_vectorize(defer_indices=True)
 
 
 """
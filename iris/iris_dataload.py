@@ -1,5 +1,5 @@
 # import iris
-from create_desc_vectors import load_data, add_embedding_config, vectorize_data
+from create_desc_vectors import load_and_vectorize
 
 # # switch namespace to the %SYS namespace
 # iris.system.Process.SetNamespace("%SYS")
@@ -16,7 +16,5 @@ from create_desc_vectors import load_data, add_embedding_config, vectorize_data
 
 if __name__ == '__main__':
 
-    table_name = "GenAI.encounters"
-    data = load_data()
-    add_embedding_config(delete=False)
-    vectorize_data(data, table_name)
\ No newline at end of file
+    # Load and vectorize without index maintenance, then build the indices once
+    data = load_and_vectorize(defer_indices=True)
\ No newline at end of file
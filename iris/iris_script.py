@@ -1,6 +1,6 @@
 import iris
 import requests
-from create_desc_vectors import load_data, vectorize_data, load_model, add_embedding_config
+from create_desc_vectors import load_model, load_and_vectorize
 
 # switch namespace to the %SYS namespace
 iris.system.Process.SetNamespace("%SYS")
@@ -23,8 +23,6 @@ iris.cls('%SYSTEM.OBJ').Import("/home/irisowner/dev/src/GenAI/encounters.xml", "
 #assert iris.ipm('load /home/irisowner/dev -v')
 
 
-table_name = "GenAI.encounters"
-data = load_data()
 #load_model()
-add_embedding_config(delete=False)
-vectorize_data(data, table_name)
\ No newline at end of file
+# Load and vectorize without index maintenance, then build the indices once
+data = load_and_vectorize(defer_indices=True)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Benchmark convert_synthea.process_table against the original row-wise implementation.
+
+The reference below is process_table / flatten_rows_to_string as they were before
+vectorization (DataFrame.agg(' '.join, axis=1) and a groupby lambda). Both versions
+run on the same tables and the merged results are compared byte for byte through
+to_csv.
+
+    python benchmark_convert_synthea.py --encounters 200000 --obs-per-encounter 20
+    python benchmark_convert_synthea.py --data /path/to/synthea/csv
+"""
+
+import argparse
+import contextlib
+import copy
+import hashlib
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import convert_synthea
+from maps import conditions_short_map, medications_short_map, observations_short_map, procedures_short_map
+
+# (table, value columns) in the order create_normalized_encounter merges them
+TABLES = [
+    ('observations', ['DESCRIPTION', 'VALUE', 'UNITS']),
+    ('conditions', ['DESCRIPTION']),
+    ('medications', ['DESCRIPTION']),
+    ('procedures', ['DESCRIPTION']),
+]
+
+
+def reference_flatten_rows_to_string(df, group_column, value_column, separator=';'):
+    grouped = df.groupby(group_column)[value_column].agg(lambda x: separator.join(map(str, x))).reset_index()
+    return grouped
+
+
+def reference_process_table(df_dict, merged_df, table_name, group_column, value_columns, prefix=None):
+    table = df_dict[table_name]
+    if table_name == 'observations':
+        df = table[table['CATEGORY'] != 'survey']
+    else:
+        df = df_dict[table_name]
+
+    if prefix:
+        df['DESCRIPTION'] = f"{prefix}: " + df[value_columns].astype(str).agg(' '.join, axis=1)
+    else:
+        df['DESCRIPTION'] = df[value_columns].astype(str).agg(' '.join, axis=1)
+
+    df = reference_flatten_rows_to_string(df, group_column, 'DESCRIPTION', ', ')
+    df = df[[group_column, 'DESCRIPTION']]
+
+    merged_df = pd.merge(merged_df, df, left_on='ENCOUNTER_ID', right_on=group_column, how='left',
+                         suffixes=('', f'_{table_name.upper()}'))
+    merged_df = merged_df.drop(columns=[group_column])
+    return merged_df
+
+
+def legacy_strings():
+    """astype(str) turned missing values into 'nan' before pandas 3; the reference relies on that"""
+    try:
+        pd.get_option('future.infer_string')
+    except KeyError:
+        return contextlib.nullcontext()
+    return pd.option_context('future.infer_string', False)
+
+
+def synthetic_tables(n_encounters: int, obs_per_encounter: int, seed: int = 0):
+    """Synthea-shaped tables with GUID encounter ids, missing values and survey rows"""
+    rng = np.random.default_rng(seed)
+    encounter_ids = np.array([f"{i:08x}-{rng.integers(1 << 16):04x}-4e2a-9c1d-{i * 7919:012x}"
+                              for i in range(n_encounters)], dtype=object)
+
+    def table(n_rows, descriptions, extra=None):
+        rows = {
+            'ENCOUNTER': rng.choice(encounter_ids, n_rows).astype(object),
+            'DESCRIPTION': rng.choice(np.array(list(descriptions) + [np.nan], dtype=object), n_rows),
+        }
+        rows.update(extra or {})
+        df = pd.DataFrame(rows).astype(object)
+        # A few rows without an encounter, as in real exports
+        df.loc[rng.random(n_rows) < 0.001, 'ENCOUNTER'] = np.nan
+        return df
+
+    n_obs = n_encounters * obs_per_encounter
+    values = np.where(rng.random(n_obs) < 0.8, np.round(rng.normal(80, 25, n_obs), 1).astype(str),
+                      rng.choice(np.array(['Never smoker', 'Negative', 'Positive'], dtype=object), n_obs))
+    observations = table(n_obs, observations_short_map.values(), {
+        'CATEGORY': rng.choice(np.array(['vital-signs', 'laboratory', 'survey', np.nan], dtype=object), n_obs),
+        'VALUE': values.astype(object),
+        'UNITS': rng.choice(np.array(['mg/dL', 'kg', '%', 'mm[Hg]', np.nan], dtype=object), n_obs),
+    })
+
+    merged = pd.DataFrame({'ENCOUNTER_ID': encounter_ids, 'PATIENT_ID': np.arange(n_encounters) // 20})
+    return merged, {
+        'observations': observations,
+        'conditions': table(n_encounters // 2, conditions_short_map.values()),
+        'medications': table(n_encounters, medications_short_map.values()),
+        'procedures': table(n_encounters, procedures_short_map.values()),
+    }
+
+
+def synthea_tables(path: str):
+    """Real Synthea CSVs, with descriptions shortened as in create_normalized_encounter"""
+    df_dict = convert_synthea.load_csvs_to_pandas(
+        path, [f"{name}.csv" for name, _ in TABLES] + ['encounters.csv'], from_hugging=False)
+    for name, short_map in (('observations', observations_short_map), ('conditions', conditions_short_map),
+                            ('medications', medications_short_map), ('procedures', procedures_short_map)):
+        df_dict[name]['DESCRIPTION'] = df_dict[name]['DESCRIPTION'].map(short_map)
+    merged = df_dict.pop('encounters')[['Id', 'PATIENT']].rename(columns={'Id': 'ENCOUNTER_ID'})
+    return merged, df_dict
+
+
+def run(process_table, merged, df_dict, label):
+    # process_table may modify the tables it is given, so every run gets its own copy
+    df_dict = copy.deepcopy(df_dict)
+    timings = {}
+    for name, value_columns in TABLES:
+        start = time.perf_counter()
+        merged = process_table(df_dict, merged, name, 'ENCOUNTER', value_columns)
+        timings[name] = time.perf_counter() - start
+    print(f"  {label}: {sum(timings.values()):.2f}s")
+    return merged, timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark vectorized process_table against the row-wise original")
+    parser.add_argument("--data", default=None, help="Directory with Synthea csv files (default: synthetic tables)")
+    parser.add_argument("--encounters", type=int, default=100_000)
+    parser.add_argument("--obs-per-encounter", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.data:
+        merged, df_dict = synthea_tables(args.data)
+    else:
+        with legacy_strings():
+            merged, df_dict = synthetic_tables(args.encounters, args.obs_per_encounter)
+    print("Rows: " + ", ".join(f"{name} {len(df_dict[name]):,}" for name, _ in TABLES))
+
+    with legacy_strings(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        reference, reference_times = run(reference_process_table, merged, df_dict, "row-wise")
+    vectorized, vectorized_times = run(convert_synthea.process_table, merged, df_dict, "vectorized")
+
+    print(f"\n{'table':<14}{'row-wise':>10}{'vectorized':>12}{'speedup':>9}")
+    for name, _ in TABLES:
+        print(f"{name:<14}{reference_times[name]:>9.2f}s{vectorized_times[name]:>11.2f}s"
+              f"{reference_times[name] / vectorized_times[name]:>8.1f}x")
+    total_reference, total_vectorized = sum(reference_times.values()), sum(vectorized_times.values())
+    print(f"{'total':<14}{total_reference:>9.2f}s{total_vectorized:>11.2f}s{total_reference / total_vectorized:>8.1f}x")
+
+    digests = [hashlib.sha256(df.to_csv(index=False).encode()).hexdigest() for df in (reference, vectorized)]
+    print(f"\nByte-identical output: {digests[0] == digests[1]} ({digests[1][:16]})")
+    if digests[0] != digests[1]:
+        raise SystemExit(1)
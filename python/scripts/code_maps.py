@@ -0,0 +1,133 @@
+"""
+Short description maps for Synthea codes, compiled and applied per category.
+
+maps.py holds the lookup tables as Python literals (over a thousand entries).
+- load_maps: reads them from maps.pkl, a pickle compiled from maps.py, instead of
+  evaluating maps.py. The pickle records a hash of maps.py and is rebuilt when
+  maps.py changes (or with `python code_maps.py`).
+- CodeMapper: turns a DESCRIPTION column into a categorical and looks up each
+  distinct description once, instead of every row. Descriptions missing from the
+  map become NaN, as Series.map did, or are kept as they are with
+  fallback='passthrough'. Either way they are counted for report().
+
+    mapper = CodeMapper(fallback='passthrough')
+    df['DESCRIPTION'] = mapper.map(df['DESCRIPTION'], 'conditions_short_map')
+    print(mapper.report())
+"""
+
+import hashlib
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+MAPS_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps.py')
+MAPS_ARTIFACT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps.pkl')
+MAP_NAMES = ['observations_short_map', 'conditions_short_map', 'medications_short_map', 'procedures_short_map',
+             'can_be_removed_observes']
+FALLBACKS = (None, 'passthrough')
+
+
+def _source_hash(source: str) -> str:
+    with open(source, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_maps(source: str = MAPS_SOURCE, artifact: str = MAPS_ARTIFACT) -> dict:
+    """Import maps.py once and pickle its tables, with the source hash, to `artifact`"""
+    import maps
+    tables = {name: getattr(maps, name) for name in MAP_NAMES}
+    with open(artifact, 'wb') as f:
+        pickle.dump({'source_hash': _source_hash(source), 'maps': tables}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return tables
+
+
+def load_maps(source: str = MAPS_SOURCE, artifact: str = MAPS_ARTIFACT) -> dict:
+    """
+    The maps.py tables by name, from the compiled artifact if it is current
+
+    Falls back to importing maps.py (and tries to rewrite the artifact) when the
+    artifact is missing, unreadable or was compiled from a different maps.py.
+    """
+    try:
+        with open(artifact, 'rb') as f:
+            compiled = pickle.load(f)
+        if compiled['source_hash'] == _source_hash(source):
+            return compiled['maps']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+    try:
+        return compile_maps(source, artifact)
+    except OSError:
+        # Read-only checkout: use maps.py directly
+        import maps
+        return {name: getattr(maps, name) for name in MAP_NAMES}
+
+
+class CodeMapper:
+    """
+    Applies the short description maps to categorical columns and counts what is unmapped
+
+    Args:
+        maps: Tables by name (defaults to load_maps())
+        fallback: None turns unmapped descriptions into NaN; 'passthrough' keeps the original text
+    """
+
+    def __init__(self, maps: dict = None, fallback: str = None):
+        if fallback not in FALLBACKS:
+            raise ValueError(f"Unknown fallback {fallback!r}, expected one of {FALLBACKS}")
+        self.maps = maps if maps is not None else load_maps()
+        self.fallback = fallback
+        # map name -> rows per unmapped description
+        self.unmapped: dict[str, pd.Series] = {}
+
+    def map(self, values: pd.Series, map_name: str) -> pd.Series:
+        """values mapped through self.maps[map_name], as a categorical with the same index"""
+        categorical = values.astype('category')
+        categories = categorical.cat.categories
+        codes = categorical.cat.codes.to_numpy()
+
+        # Look up each distinct description once
+        mapped = categories.map(self.maps[map_name])
+        missing = np.asarray(mapped.isna())
+        if missing.any():
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))[missing]
+            self.add_unmapped({map_name: pd.Series(counts, index=categories[missing])})
+            if self.fallback == 'passthrough':
+                mapped = mapped.where(~missing, categories)
+
+        # Several descriptions can share a short name, so the mapped categories are factorized again;
+        # the -1 appended to the lookup keeps missing values (code -1) missing
+        new_codes, new_categories = pd.factorize(mapped)
+        codes = np.append(new_codes, -1)[codes]
+        return pd.Series(pd.Categorical.from_codes(codes, categories=new_categories), index=values.index,
+                         name=values.name)
+
+    def add_unmapped(self, unmapped: dict[str, pd.Series]):
+        """Add unmapped counts, e.g. from a mapper used in another process"""
+        for map_name, counts in unmapped.items():
+            previous = self.unmapped.get(map_name)
+            self.unmapped[map_name] = counts if previous is None else previous.add(counts, fill_value=0).astype(int)
+
+    def report(self, limit: int = 10) -> str:
+        """Unmapped descriptions per map, most frequent first"""
+        if not self.unmapped:
+            return "All descriptions mapped"
+        lines = []
+        action = "kept as is" if self.fallback == 'passthrough' else "set to NaN"
+        for map_name, counts in self.unmapped.items():
+            counts = counts.sort_values(ascending=False, kind='stable')
+            lines.append(f"{map_name}: {len(counts)} unmapped descriptions in {counts.sum()} rows ({action})")
+            lines.extend(f"    {count:>8}  {description}" for description, count in counts.head(limit).items())
+            if len(counts) > limit:
+                lines.append(f"    ... {len(counts) - limit} more")
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    start = time.perf_counter()
+    tables = compile_maps()
+    print(f"Compiled {', '.join(f'{name} ({len(table)})' for name, table in tables.items())} "
+          f"to {MAPS_ARTIFACT} in {time.perf_counter() - start:.3f}s")
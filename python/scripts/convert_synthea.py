@@ -1,8 +1,31 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import os
+import pickle
 import pytz
 import datetime
-from maps import observations_short_map, conditions_short_map, medications_short_map, procedures_short_map, can_be_removed_observes
+import tempfile
+from typing import Iterator
+from encounter_io import FORMATS, EncounterWriter
+from code_maps import CodeMapper
+
+# Column types of the Synthea tables, so every read (whole file or chunk) gets the same dtypes.
+# Without them a chunk with no missing REASONCODE infers int64 instead of float64, and an
+# observations chunk with only numeric VALUEs infers float64 instead of text.
+synthea_dtypes = {
+    'patients': {'Id': str, 'BIRTHDATE': str, 'FIRST': str},
+    'encounters': {'Id': str, 'START': str, 'STOP': str, 'PATIENT': str, 'ORGANIZATION': str, 'PROVIDER': str,
+                   'PAYER': str, 'ENCOUNTERCLASS': str, 'CODE': 'int64', 'DESCRIPTION': str,
+                   'BASE_ENCOUNTER_COST': 'float64', 'TOTAL_CLAIM_COST': 'float64', 'PAYER_COVERAGE': 'float64',
+                   'REASONCODE': 'float64', 'REASONDESCRIPTION': str},
+    'observations': {'PATIENT': str, 'ENCOUNTER': str, 'CATEGORY': str, 'DESCRIPTION': str, 'VALUE': str,
+                     'UNITS': str},
+    'conditions': {'PATIENT': str, 'ENCOUNTER': str, 'DESCRIPTION': str},
+    'medications': {'PATIENT': str, 'ENCOUNTER': str, 'DESCRIPTION': str},
+    'procedures': {'PATIENT': str, 'ENCOUNTER': str, 'DESCRIPTION': str},
+}
 
 def convert_time_to_datetime(df: pd.DataFrame, time_col: str) -> pd.DataFrame:
     # ensure column is datettime type
@@ -19,9 +42,9 @@ def load_csvs_to_pandas(dirpath: str, filenames: list[str],
         else:
             filepath = os.path.join(dirpath, filename)
         print(f"Filepath={filepath}")
-        df = pd.read_csv(filepath)
         #remove the .csv from filename for key
         key = filename[:-4]
+        df = pd.read_csv(filepath, dtype=synthea_dtypes.get(key))
         df_dict[key] = df
     return df_dict
 
@@ -39,10 +62,22 @@ def replace_complex_ids(df: pd.DataFrame, id_map: dict[str, int], col_name: str)
     df[col_name] = df[col_name].map(id_map)
     return df
 
+def as_str(series: pd.Series) -> np.ndarray:
+    """
+    str() of every value as an object array, like astype(str) before pandas 3
+    (missing values become 'nan' instead of staying missing)
+    """
+    return np.frompyfunc(str, 1, 1)(series.to_numpy(dtype=object))
+
 def flatten_rows_to_string(df, group_column, value_column, separator=';'):
     """
     Flattens rows within groups into a single string in a new column.
 
+    Equivalent to df.groupby(group_column)[value_column].agg(separator.join) (groups in
+    sorted order, rows in their original order, null groups dropped), but the rows are
+    sorted once by their group code and joined with a single str.join, then split at
+    the group boundaries, instead of calling Python once per group.
+
     Args:
       df: The Pandas DataFrame.
       group_column: The column to group by.
@@ -52,13 +87,41 @@ def flatten_rows_to_string(df, group_column, value_column, separator=';'):
     Returns:
       A new DataFrame with an additional column containing the flattened strings.
     """
-    # Group by the specified column and aggregate with join
-    grouped = df.groupby(group_column)[value_column].agg(lambda x: separator.join(map(str, x))).reset_index()
-
-    # Rename the aggregated column
-    #grouped.rename(columns={value_column: f'{value_column}_flat'}, inplace=True)
+    codes, groups = pd.factorize(df[group_column], sort=True)
+    values = as_str(df[value_column])
+
+    # Drop null groups (code -1) and bring each group's rows together, keeping their order
+    keep = codes >= 0
+    codes, values = codes[keep], values[keep]
+    order = np.argsort(codes, kind='stable')
+    codes, values = codes[order], values[order]
+    if not len(values):
+        return pd.DataFrame({group_column: groups, value_column: pd.Series([], dtype=str)})
+
+    # Interleave the values with the separator, or a boundary marker after a group's last row
+    # (values are assumed not to contain the NUL character)
+    boundary = '\x00'
+    last_in_group = np.append(codes[1:] != codes[:-1], True)
+    pieces = np.empty(len(values) * 2, dtype=object)
+    pieces[0::2] = values
+    joiners = np.full(len(values), separator, dtype=object)
+    joiners[last_in_group] = boundary
+    pieces[1::2] = joiners
+    flattened = ''.join(pieces).split(boundary)[:-1]
+
+    # Every code left is used, so the groups line up with the flattened strings
+    return pd.DataFrame({group_column: groups, value_column: flattened})
+
+def concat_columns(df: pd.DataFrame, columns: list[str], prefix: str = None, separator: str = ' ') -> pd.Series:
+    """
+    Join the given columns of each row into one string, column-wise with str.cat
 
-    return grouped
+    Same result as df[columns].astype(str).agg(separator.join, axis=1) did before
+    pandas 3, with f"{prefix}: " in front when a prefix is given.
+    """
+    text = [pd.Series(as_str(df[column]), index=df.index, dtype=object) for column in columns]
+    joined = text[0].str.cat(text[1:], sep=separator) if len(text) > 1 else text[0]
+    return f"{prefix}: " + joined if prefix else joined
 
 def count_non_null_pairs(df: pd.DataFrame, col1: str, col2: str) -> int:
     # Find the number of times where col1 is not null and col2 is null as a percent of total rows
@@ -93,10 +156,7 @@ def process_table(df_dict: dict[str, pd.DataFrame], merged_df: pd.DataFrame, tab
         df = df_dict[table_name]
 
     # Concatenate specified columns
-    if prefix:
-      df['DESCRIPTION'] = f"{prefix}: " + df[value_columns].astype(str).agg(' '.join, axis=1)
-    else:
-      df['DESCRIPTION'] = df[value_columns].astype(str).agg(' '.join, axis=1)
+    df = pd.DataFrame({group_column: df[group_column], 'DESCRIPTION': concat_columns(df, value_columns, prefix)})
 
     # Flatten rows within groups into a single string in a new column
     df = flatten_rows_to_string(df, group_column, 'DESCRIPTION', ', ')
@@ -104,28 +164,19 @@ def process_table(df_dict: dict[str, pd.DataFrame], merged_df: pd.DataFrame, tab
     # Drop columns that are no longer needed
     df = df[[group_column, 'DESCRIPTION']]
 
+    return merge_descriptions(merged_df, df, table_name, group_column)
+
+def merge_descriptions(merged_df: pd.DataFrame, df: pd.DataFrame, table_name: str, group_column: str) -> pd.DataFrame:
     # Merge with the main DataFrame and drop the group column used for joining
     merged_df = pd.merge(merged_df, df, left_on='ENCOUNTER_ID', right_on=group_column, how='left', suffixes=('', f'_{table_name.upper()}'))
     merged_df = merged_df.drop(columns=[group_column])
     return merged_df
 
-def create_normalized_encounter(df_dict: dict[str, pd.DataFrame]) -> pd.DataFrame:
+def merge_patient_encounters(patient_df: pd.DataFrame, encounter_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Create a normalized encounter DataFrame from the given CSVs
-    Should include the patient id, all fields from encounter, and the Description field
-    from each table concatenated in a single column per encounter
-
+    Join encounters to their patient (indexed by Id), rename the id columns and set PATIENT_AGE
     """
-    # First create a normalized patient and encounter DataFrame, only including
-    # the patient id and all fields from encounter
-    patient_df = df_dict['patients'][['Id','BIRTHDATE', 'FIRST']].set_index('Id')
-    encounter_df = df_dict['encounters']
     encounter_df = encounter_df.drop(columns=['ORGANIZATION', 'PROVIDER', 'PAYER'])
-
-    # REMOVE ME
-    # Use to see small sample file in Colab
-    #patient_df = patient_df.head(10)
-
     merged_df = pd.merge(patient_df, encounter_df, left_index=True, right_on='PATIENT')
 
     # Change name of ID to Encounter ID and Patient to Patient ID
@@ -140,52 +191,236 @@ def create_normalized_encounter(df_dict: dict[str, pd.DataFrame]) -> pd.DataFram
 
     # Synthea birthdates don't make any sense so let's nudge them to be a a little better
     merged_df['PATIENT_AGE'] = merged_df['PATIENT_AGE'].clip(lower=3)
+    return merged_df
+
+def create_normalized_encounter(df_dict: dict[str, pd.DataFrame], mapper: CodeMapper = None,
+                                workers: int = 1) -> pd.DataFrame:
+    """
+    Create a normalized encounter DataFrame from the given CSVs
+    Should include the patient id, all fields from encounter, and the Description field
+    from each table concatenated in a single column per encounter
+
+    Descriptions are shortened with mapper (a CodeMapper on the maps.py tables by default),
+    which also counts the descriptions it could not map. With workers > 1 the child tables
+    are flattened in a process pool (see describe_child_tables).
+    """
+    mapper = mapper or CodeMapper()
+
+    # First create a normalized patient and encounter DataFrame, only including
+    # the patient id and all fields from encounter
+    patient_df = df_dict['patients'][['Id','BIRTHDATE', 'FIRST']].set_index('Id')
+
+    # REMOVE ME
+    # Use to see small sample file in Colab
+    #patient_df = patient_df.head(10)
+
+    merged_df = merge_patient_encounters(patient_df, df_dict['encounters'])
 
     print(f"total patients: {len(patient_df)}")
     print(f"total patient encounters: {len(merged_df)}")
 
+    if workers > 1:
+        descriptions = describe_child_tables(df_dict, mapper, workers)
+        return join_descriptions(merged_df, descriptions)
+
     # Remove unneccessary observations with can_be_removed_observes list
     observes = df_dict['observations']
     observes = observes[observes['CATEGORY'] != 'survey']
-    observes = observes[~observes['DESCRIPTION'].isin(can_be_removed_observes)]
+    observes = observes[~observes['DESCRIPTION'].isin(mapper.maps['can_be_removed_observes'])]
     df_dict['observations'] = observes
 
     # Merge OBSERVATIONS
     # Map the description to the shorthand using observations_short_map
-    df_dict['observations']['DESCRIPTION'] = df_dict['observations']['DESCRIPTION'].map(observations_short_map)
+    df_dict['observations']['DESCRIPTION'] = mapper.map(df_dict['observations']['DESCRIPTION'], 'observations_short_map')
     merged_df = process_table(df_dict, merged_df, 'observations', 'ENCOUNTER', ['DESCRIPTION', 'VALUE', 'UNITS'])
 
     # Merge CONDITIONS
     # Map the description to the shorthand using conditions_short_map
-    df_dict['conditions']['DESCRIPTION'] = df_dict['conditions']['DESCRIPTION'].map(conditions_short_map)
+    df_dict['conditions']['DESCRIPTION'] = mapper.map(df_dict['conditions']['DESCRIPTION'], 'conditions_short_map')
     merged_df = process_table(df_dict, merged_df, 'conditions', 'ENCOUNTER', ['DESCRIPTION'])
 
     # Merge medications
     # Map the description to the shorthand using medications_short_map
-    df_dict['medications']['DESCRIPTION'] = df_dict['medications']['DESCRIPTION'].map(medications_short_map)
+    df_dict['medications']['DESCRIPTION'] = mapper.map(df_dict['medications']['DESCRIPTION'], 'medications_short_map')
     merged_df = process_table(df_dict, merged_df, 'medications', 'ENCOUNTER', ['DESCRIPTION'])
 
     # Merge procedures
     # Map the description to the shorthand using procedures_short_map
-    df_dict['procedures']['DESCRIPTION'] = df_dict['procedures']['DESCRIPTION'].map(procedures_short_map)
+    df_dict['procedures']['DESCRIPTION'] = mapper.map(df_dict['procedures']['DESCRIPTION'], 'procedures_short_map')
     merged_df = process_table(df_dict, merged_df, 'procedures', 'ENCOUNTER', ['DESCRIPTION'])
 
     return merged_df
 
-def get_all_values(df: pd.DataFrame, col: str) -> set[str]:
-    return set(df[col].unique())
+# Child tables flattened into each encounter, in merge order: (table, short description map name, value columns)
+child_tables = [
+    ('observations', 'observations_short_map', ['DESCRIPTION', 'VALUE', 'UNITS']),
+    ('conditions', 'conditions_short_map', ['DESCRIPTION']),
+    ('medications', 'medications_short_map', ['DESCRIPTION']),
+    ('procedures', 'procedures_short_map', ['DESCRIPTION']),
+]
 
-if __name__ == '__main__':
-    
-    path = '/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters'
-    output_path = '/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters'
-    output_file = 'patient_encounters1'
-    
+def describe_rows(df: pd.DataFrame, table_name: str, map_name: str, value_columns: list[str],
+                  mapper: CodeMapper) -> pd.DataFrame:
+    """
+    Filter and shorten the rows of a child table (or a chunk of one) and flatten them
+    to one ENCOUNTER, DESCRIPTION row per encounter, as create_normalized_encounter does
+    """
+    if table_name == 'observations':
+        df = df[(df['CATEGORY'] != 'survey') & ~df['DESCRIPTION'].isin(mapper.maps['can_be_removed_observes'])]
+    df = df.assign(DESCRIPTION=mapper.map(df['DESCRIPTION'], map_name))
+    df = pd.DataFrame({'ENCOUNTER': df['ENCOUNTER'], 'DESCRIPTION': concat_columns(df, value_columns)})
+    return flatten_rows_to_string(df, 'ENCOUNTER', 'DESCRIPTION', ', ')
+
+def table_columns(table_name: str, value_columns: list[str]) -> list[str]:
+    """Columns of a child table that describe_rows needs"""
+    return ['ENCOUNTER'] + value_columns + (['CATEGORY'] if table_name == 'observations' else [])
+
+def _describe_table(df: pd.DataFrame, table_name: str, map_name: str, value_columns: list[str],
+                    mapper: CodeMapper) -> tuple[pd.DataFrame, dict[str, pd.Series]]:
+    """Process pool task: a table's flattened descriptions, and what its mapper could not map"""
+    return describe_rows(df, table_name, map_name, value_columns, mapper), mapper.unmapped
+
+def describe_child_tables(df_dict: dict[str, pd.DataFrame], mapper: CodeMapper, workers: int) -> dict[str, pd.DataFrame]:
+    """
+    Flatten the child tables concurrently, one process pool task per table
+
+    Each task gets only the columns it needs and a fresh CodeMapper with the same maps,
+    and returns a compact ENCOUNTER, DESCRIPTION frame; its unmapped counts are added to mapper.
+    """
+    with ProcessPoolExecutor(max_workers=min(workers, len(child_tables))) as pool:
+        futures = {
+            table_name: pool.submit(_describe_table, df_dict[table_name][table_columns(table_name, value_columns)],
+                                    table_name, map_name, value_columns, CodeMapper(mapper.maps, mapper.fallback))
+            for table_name, map_name, value_columns in child_tables
+        }
+        descriptions = {}
+        for table_name, future in futures.items():
+            descriptions[table_name], unmapped = future.result()
+            mapper.add_unmapped(unmapped)
+    return descriptions
+
+def join_descriptions(merged_df: pd.DataFrame, descriptions: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Add every table's descriptions as DESCRIPTION_<TABLE> with one left join on ENCOUNTER_ID
+
+    Same columns and rows as a merge_descriptions call per table, without copying the
+    growing merged_df for every table.
+    """
+    wide = pd.concat([df.set_index('ENCOUNTER')['DESCRIPTION'].rename(f'DESCRIPTION_{table_name.upper()}')
+                      for table_name, df in descriptions.items()], axis=1)
+    return merged_df.join(wide, on='ENCOUNTER_ID')
+
+def _spill(path: str, df: pd.DataFrame):
+    """Append a frame to a spill file"""
+    with open(path, 'ab') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _read_spill(path: str) -> list[pd.DataFrame]:
+    frames = []
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    frames.append(pickle.load(f))
+                except EOFError:
+                    break
+    return frames
+
+def iter_normalized_encounters(dirpath: str, chunksize: int = 500_000, partitions: int = 32, work_dir: str = None,
+                               mapper: CodeMapper = None) -> Iterator[pd.DataFrame]:
+    """
+    Convert a Synthea export that does not fit in memory, yielding the encounters one partition at a time
+
+    Together the frames hold the same rows, in the same order, as create_normalized_encounter
+    followed by the date conversion and integer ids in __main__, but only patients.csv is
+    held in memory:
+    1. encounters.csv and the child tables are read in chunks of `chunksize` rows. Every
+       chunk of a child table is flattened to partial per-encounter strings right away.
+    2. Encounters and partial strings are spilled to `partitions` files by patient row
+       range (every row of a patient lands in the same partition).
+    3. Each partition is then loaded on its own, its partial strings joined and merged
+       once with its encounters, and yielded.
+    Peak memory is roughly one chunk or one partition, so raise `partitions` for larger
+    populations.
+    """
+    mapper = mapper or CodeMapper()
+    patients = pd.read_csv(os.path.join(dirpath, 'patients.csv'), usecols=['Id', 'BIRTHDATE', 'FIRST'],
+                           dtype=synthea_dtypes['patients'])
+    patient_df = patients.set_index('Id')
+    patient_id_map = create_id_map(patients, 'Id')
+    partitions = max(1, min(partitions, len(patients)))
+
+    def partition_of(patient_ids: pd.Series) -> pd.Series:
+        return patient_ids.map(patient_id_map) * partitions // len(patients)
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as spill_dir:
+        spill_path = lambda name, partition: os.path.join(spill_dir, f"{name}-{partition}.pkl")
+
+        # Encounters, keeping their row number in encounters.csv as the integer ENCOUNTER_ID
+        offset = 0
+        for chunk in pd.read_csv(os.path.join(dirpath, 'encounters.csv'), dtype=synthea_dtypes['encounters'],
+                                 chunksize=chunksize):
+            chunk['ENCOUNTER_INDEX'] = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            merged = merge_patient_encounters(patient_df, chunk)
+            for partition, part in merged.groupby(partition_of(merged['PATIENT_ID']), sort=False):
+                _spill(spill_path('encounters', int(partition)), part)
+        print(f"total patients: {len(patients)}")
+        print(f"total encounters read: {offset}")
+
+        # Partial descriptions per encounter and chunk; rows of unknown patients never match an encounter
+        for table_name, map_name, value_columns in child_tables:
+            columns = ['PATIENT'] + table_columns(table_name, value_columns)
+            for chunk in pd.read_csv(os.path.join(dirpath, f"{table_name}.csv"), usecols=columns,
+                                     dtype=synthea_dtypes[table_name], chunksize=chunksize):
+                for partition, part in chunk.groupby(partition_of(chunk['PATIENT']), sort=False):
+                    _spill(spill_path(table_name, int(partition)),
+                           describe_rows(part, table_name, map_name, value_columns, mapper))
+
+        for partition in range(partitions):
+            encounters = _read_spill(spill_path('encounters', partition))
+            if not encounters:
+                continue
+            # Patient order, then encounters.csv order within a patient, like the in-memory merge
+            merged_df = pd.concat(encounters)
+            merged_df = merged_df.iloc[np.lexsort((merged_df['ENCOUNTER_INDEX'], merged_df['PATIENT_ID'].map(patient_id_map)))]
+            for table_name, _, _ in child_tables:
+                partials = _read_spill(spill_path(table_name, partition))
+                df = pd.concat(partials) if partials else pd.DataFrame({'ENCOUNTER': [], 'DESCRIPTION': []}, dtype=str)
+                # Partials are in file order, so joining them again gives the full per-encounter string
+                df = flatten_rows_to_string(df, 'ENCOUNTER', 'DESCRIPTION', ', ')
+                merged_df = merge_descriptions(merged_df, df, table_name, 'ENCOUNTER')
+
+            merged_df = convert_time_to_datetime(merged_df, 'START')
+            merged_df = convert_time_to_datetime(merged_df, 'STOP')
+            merged_df = replace_complex_ids(merged_df, patient_id_map, 'PATIENT_ID')
+            merged_df['ENCOUNTER_ID'] = merged_df.pop('ENCOUNTER_INDEX')
+            yield merged_df
+
+def stream_normalized_encounter(dirpath: str, output_file: str, chunksize: int = 500_000, partitions: int = 32,
+                                work_dir: str = None, formats=('csv', 'json'), mapper: CodeMapper = None) -> int:
+    """
+    Convert a Synthea export that does not fit in memory (see iter_normalized_encounters),
+    writing {output_file}.<format> (see encounter_io.py) one partition at a time
+
+    Returns:
+        The number of encounter rows written.
+    """
+    with EncounterWriter(output_file, formats) as writer:
+        for merged_df in iter_normalized_encounters(dirpath, chunksize, partitions, work_dir, mapper):
+            writer.write(merged_df)
+            print(f"{writer.rows} encounters written")
+    return writer.rows
+
+def convert_in_memory(dirpath: str, mapper: CodeMapper = None, workers: int = 1) -> pd.DataFrame:
+    """
+    Load a whole Synthea export and return the normalized encounters with dates and integer ids
+    """
     filenames = ['patients.csv', 'encounters.csv', 'observations.csv', 'conditions.csv',
                 'medications.csv', 'procedures.csv']
 
-    df_dict = load_csvs_to_pandas(path, filenames, from_hugging=False)
-    normalized_encounter_df = create_normalized_encounter(df_dict)
+    df_dict = load_csvs_to_pandas(dirpath, filenames, from_hugging=False)
+    normalized_encounter_df = create_normalized_encounter(df_dict, mapper, workers)
 
     # Convert time columns to datetime
     normalized_encounter_df = convert_time_to_datetime(normalized_encounter_df, 'START')
@@ -197,8 +432,73 @@ if __name__ == '__main__':
 
     final_df = replace_complex_ids(normalized_encounter_df, patient_id_map, 'PATIENT_ID')
     final_df = replace_complex_ids(final_df, encounter_id_map, 'ENCOUNTER_ID')
+    return final_df
 
-    # Save final df
-    final_df.to_csv(f'{output_path}/{output_file}.csv', index=False, date_format='%Y-%m-%d')
-    final_df.to_json(f'{output_path}/{output_file}.json', orient='records', lines=True, date_format='%Y-%m-%d')
+def compare_stream_to_memory(dirpath: str, chunksize: int = 500_000, partitions: int = 32, work_dir: str = None,
+                             fallback: str = None) -> list[str]:
+    """
+    Convert an export both in memory and with iter_normalized_encounters and return the
+    columns whose dtype or values differ (empty when the two match). Both results are
+    held in memory, so this is only meant for small exports.
+    """
+    in_memory = convert_in_memory(dirpath, CodeMapper(fallback=fallback)).reset_index(drop=True)
+    parts = list(iter_normalized_encounters(dirpath, chunksize, partitions, work_dir, CodeMapper(fallback=fallback)))
+    streamed = pd.concat(parts).reset_index(drop=True)
+    if list(in_memory.columns) != list(streamed.columns):
+        return sorted(set(in_memory.columns).symmetric_difference(streamed.columns)) or ['column order']
+    # Partitions are written one at a time, so each must have the in-memory dtypes, not just their concatenation
+    return [column for column in in_memory.columns
+            if any(part[column].dtype != in_memory[column].dtype for part in parts)
+            or not in_memory[column].equals(streamed[column])]
+
+def get_all_values(df: pd.DataFrame, col: str) -> set[str]:
+    return set(df[col].unique())
+
+if __name__ == '__main__':
+    
+    path = '/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters'
+    output_path = '/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters'
+    output_file = 'patient_encounters1'
 
+    parser = argparse.ArgumentParser(description="Flatten a Synthea csv export into one row per encounter")
+    parser.add_argument("--input", default=path, help="Directory with the Synthea csv files")
+    parser.add_argument("--output", default=f'{output_path}/{output_file}',
+                        help="Output path without extension; one file per --formats entry is written")
+    parser.add_argument("--formats", default="csv,json",
+                        help=f"Comma separated output formats, some of {','.join(FORMATS)}")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the tables in chunks and spill to disk, for exports larger than memory")
+    parser.add_argument("--chunksize", type=int, default=500_000, help="Rows per chunk with --stream")
+    parser.add_argument("--partitions", type=int, default=32,
+                        help="Patient partitions with --stream; each is merged in memory on its own")
+    parser.add_argument("--work-dir", default=None, help="Directory for --stream spill files (default: system temp)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes for flattening the child tables concurrently (in memory mode)")
+    parser.add_argument("--unmapped", choices=['nan', 'passthrough'], default='nan',
+                        help="Descriptions missing from maps.py become NaN, or are kept as they are")
+    parser.add_argument("--check", action="store_true",
+                        help="Convert --input both in memory and streamed (--chunksize, --partitions) and report "
+                             "whether they match, without writing output; for small exports")
+    args = parser.parse_args()
+
+    formats = tuple(args.formats.split(','))
+    fallback = None if args.unmapped == 'nan' else args.unmapped
+    if args.check:
+        differences = compare_stream_to_memory(args.input, args.chunksize, args.partitions, args.work_dir, fallback)
+        print(f"Streamed and in-memory conversions differ in: {', '.join(differences)}" if differences
+              else "Streamed and in-memory conversions match")
+        raise SystemExit(1 if differences else 0)
+
+    mapper = CodeMapper(fallback=fallback)
+    if args.stream:
+        stream_normalized_encounter(args.input, args.output, args.chunksize, args.partitions, args.work_dir, formats,
+                                    mapper)
+        print(mapper.report())
+        raise SystemExit(0)
+
+    final_df = convert_in_memory(args.input, mapper, args.workers)
+    print(mapper.report())
+
+    # Save final df
+    with EncounterWriter(args.output, formats) as writer:
+        writer.write(final_df)
@@ -0,0 +1,167 @@
+"""
+Reading and writing the flattened encounters file (patient_encounters1.*).
+
+convert_synthea.py can write it as csv, JSON lines and/or Parquet:
+- csv/json: text, as before; every reader re-parses and re-infers types
+- parquet: columnar with the dtypes kept (ENCOUNTERCLASS and DESCRIPTION as
+  categoricals, START/STOP/BIRTHDATE as dates, integer ids), so readers can load
+  only the columns they need without parsing the rest
+
+read_encounters picks the reader from the file extension, so the note and bio
+generators take either format.
+
+    python encounter_io.py patient_encounters1.csv   # write .parquet next to it and compare
+"""
+
+import argparse
+import os
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ('csv', 'json', 'parquet')
+categorical_columns = ['ENCOUNTERCLASS', 'DESCRIPTION']
+date_columns = ['START', 'STOP', 'BIRTHDATE']
+int_columns = ['ENCOUNTER_ID', 'PATIENT_ID', 'CODE', 'PATIENT_AGE']
+float_columns = ['BASE_ENCOUNTER_COST', 'TOTAL_CLAIM_COST', 'PAYER_COVERAGE', 'REASONCODE']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for parquet encounter files (pip install pyarrow)")
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """Categoricals for the repeated descriptions and plain dates for the date columns"""
+    df = df.copy()
+    for column in date_columns:
+        # Timestamps, datetime.date objects (convert_time_to_datetime) or text read back from a csv
+        if column in df:
+            df[column] = pd.to_datetime(df[column], utc=True).dt.date
+    for column in categorical_columns:
+        if column in df:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def _arrow_type(column: str, inferred: "pa.DataType") -> "pa.DataType":
+    if column in date_columns:
+        return pa.date32()
+    if column in int_columns:
+        return pa.int64()
+    if column in float_columns:
+        return pa.float64()
+    if column in categorical_columns:
+        # 32 bit indices so later parts with more categories still fit
+        return pa.dictionary(pa.int32(), pa.string())
+    # Text columns (FIRST, REASONDESCRIPTION, DESCRIPTION_*, notes) and anything undeclared that
+    # is all null in the first part, which would otherwise be typed null and reject later parts
+    text = pa.types.is_null(inferred) or pa.types.is_string(inferred) or pa.types.is_large_string(inferred)
+    return pa.string() if text else inferred
+
+
+def _arrow_schema(table: "pa.Table") -> "pa.Schema":
+    """The declared type of each encounter column, not the one inferred from the first part"""
+    fields = [field.with_type(_arrow_type(field.name, field.type)) for field in table.schema]
+    return pa.schema(fields, metadata=table.schema.metadata)
+
+
+class EncounterWriter:
+    """
+    Writes encounters to {output}.csv, {output}.json and/or {output}.parquet, in one or more parts
+
+    Existing files are replaced. Each write() appends a part: csv rows (header on the first
+    part only), JSON lines, or a Parquet row group.
+    """
+
+    def __init__(self, output: str, formats=('csv', 'json')):
+        unknown = set(formats) - set(FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown encounter formats {sorted(unknown)}, expected some of {FORMATS}")
+        if 'parquet' in formats:
+            _require_pyarrow()
+        self.output = output
+        self.formats = formats
+        self.rows = 0
+        self._parquet = None
+        for fmt in formats:
+            if os.path.exists(f'{output}.{fmt}'):
+                os.remove(f'{output}.{fmt}')
+
+    def write(self, df: pd.DataFrame):
+        if 'csv' in self.formats:
+            df.to_csv(f'{self.output}.csv', mode='a', header=self.rows == 0, index=False, date_format='%Y-%m-%d')
+        if 'json' in self.formats:
+            with open(f'{self.output}.json', 'a') as f:
+                df.to_json(f, orient='records', lines=True, date_format='%Y-%m-%d')
+        if 'parquet' in self.formats:
+            columnar = to_columnar(df)
+            if self._parquet is None:
+                schema = _arrow_schema(pa.Table.from_pandas(columnar, preserve_index=False))
+                self._parquet = pq.ParquetWriter(f'{self.output}.parquet', schema)
+            self._parquet.write_table(pa.Table.from_pandas(columnar, schema=self._parquet.schema, preserve_index=False))
+        self.rows += len(df)
+
+    def close(self):
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_encounters(path: str, columns: list[str] = None) -> pd.DataFrame:
+    """
+    Read an encounters file written by convert_synthea.py (or the generators), by extension
+
+    Only `columns` are read: Parquet skips the other column chunks entirely, csv parses
+    only those fields, and JSON lines is read whole and then selected.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        _require_pyarrow()
+        return pd.read_parquet(path, columns=columns)
+    if extension in ('.json', '.jsonl'):
+        df = pd.read_json(path, lines=True)
+        return df[columns] if columns else df
+    return pd.read_csv(path, usecols=columns)
+
+
+def _timed(label: str, read):
+    start = time.perf_counter()
+    df = read()
+    print(f"  {label:<36}{time.perf_counter() - start:>8.3f}s  {len(df.columns)} columns")
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert an encounters csv to Parquet and compare size and load time")
+    parser.add_argument("csv", help="Encounters csv written by convert_synthea.py")
+    parser.add_argument("--columns", default="PATIENT_ID,ENCOUNTER_ID,DESCRIPTION,PATIENT_AGE",
+                        help="Comma separated columns for the column subset load")
+    args = parser.parse_args()
+
+    output = os.path.splitext(args.csv)[0]
+    with EncounterWriter(output, formats=('parquet',)) as writer:
+        writer.write(pd.read_csv(args.csv))
+    columns = args.columns.split(',')
+
+    for fmt in ('csv', 'json', 'parquet'):
+        if os.path.exists(f'{output}.{fmt}'):
+            print(f"{output}.{fmt}: {os.path.getsize(f'{output}.{fmt}') / 2 ** 20:.1f} MB")
+    for fmt in ('csv', 'parquet'):
+        _timed(f"{fmt} all columns", lambda: read_encounters(f'{output}.{fmt}'))
+        _timed(f"{fmt} {len(columns)} columns", lambda: read_encounters(f'{output}.{fmt}', columns))
+
+    print("parquet dtypes:")
+    print(read_encounters(f'{output}.parquet').dtypes.to_string())
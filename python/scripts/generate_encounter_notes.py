@@ -1,16 +1,32 @@
+import argparse
+import asyncio
+import csv
+import io
+import os
+from typing import Optional
+
+import numpy as np
 import pandas as pd
-from litellm import completion
 import dotenv
-import traceback
 
-from diskcache import Cache
-cache = Cache()
+from encounter_io import read_encounters
+from llm_batch import CostTracker, Manifest, RateLimiter, acompletion_with_retry, run_jobs
+from llm_cache import LLMCache
+from note_parsing import NotesResponse, ParsedNotes, parse_response
+from prompt_packing import PromptBatch, pack_patients
 
 dotenv.load_dotenv()
 
-path = "/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters/patient_encounters1.csv"
-output_path = "/Users/psulin/repos/genai-workshop-READY2025/data/encounters"
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+path = os.path.join(data_dir, '1000_patients_encounters', 'patient_encounters1.csv')
+output_path = os.path.join(data_dir, 'encounters')
 model = "gpt-4.1-mini"
+# Shared response cache, set in __main__ (see llm_cache.py)
+cache = None
+
+# Bump a version whenever its prompt text changes so cached responses are not reused
+prompt_versions = {"csv": "encounter-csv-2", "json": "encounter-json-1"}
+request_params = {"temperature": .7}
 
 
 encounter_prompt = """
@@ -18,6 +34,9 @@ Generate a clinical encounter note for each patient using the existing data for
 Some comments can be made about the general health of the patient and previous encounters, but don't always include them.
 Add the note to the clinical notes column. The data must be returned in csv format and a bio section.
 Only include the PATIENT_ID,ENCOUNTER_ID and CLINICAL_NOTES fields in the CSV response. Clinical notes must be in double quotes.
+The encounters can belong to several patients. Rows with ENCOUNTER_ID PRIOR summarise the patient's earlier encounters; use them
+for context but don't write notes for them.
+In the bio section write one line per patient: the PATIENT_ID, a colon and a short patient bio.
 
 encounters: 
 ```csv
@@ -29,10 +48,29 @@ Example response:
 PATIENT_ID,ENCOUNTER_ID,CLINICAL_NOTES
 1,1,"Something here"
 1,2,"A clinical note for encounter 2"
+2,3,"A clinical note for another patient"
+```
+
+```bio
+1: A short bio for patient 1
+2: A short bio for patient 2
 ```
 """
 
 
+encounter_json_prompt = """
+Generate a clinical encounter note for each patient using the existing data for each encounter record. Vary the notes, don't always include the age, for example.
+Some comments can be made about the general health of the patient and previous encounters, but don't always include them.
+The encounters can belong to several patients. Rows with ENCOUNTER_ID PRIOR summarise the patient's earlier encounters; use them
+for context but don't write notes for them.
+Return one entry in notes for every encounter (with its PATIENT_ID and ENCOUNTER_ID exactly as given) and one short bio per patient in bios.
+
+encounters: 
+```csv
+{csv_data}
+```
+"""
+
 
 encounter_prompt_bak = """
 Generate a clinical encounter note for each patient using the existing data for each encounter record.
@@ -53,96 +91,257 @@ encounters:
 
 """
 
-df = pd.read_csv(path)
 fields = ['PATIENT_ID', 'FIRST', 'ENCOUNTER_ID', 'DESCRIPTION', 'PATIENT_AGE', 'DESCRIPTION_PROCEDURES', 
           'DESCRIPTION_MEDICATIONS', 'DESCRIPTION_CONDITIONS', 'CLINICAL_NOTES']
+encounter_max = 500
+
+
+def load_encounters(path: str) -> pd.DataFrame:
+    # csv or parquet (see encounter_io.py); only the prompt columns are read
+    encounters = read_encounters(path, columns=[field for field in fields if field != 'CLINICAL_NOTES'])
+    encounters['CLINICAL_NOTES'] = ''
+    encounters = encounters[fields]
 
-df['CLINICAL_NOTES'] = ''
-encounters = df[fields]
+    # Remove the term (procedure) from all DESCRIPTION
+    encounters['DESCRIPTION'] = encounters['DESCRIPTION'].str.replace(' (procedure)', '', regex=False)
+    return encounters
 
-# Remove the term (procedure) from all DESCRIPTION
-encounters['DESCRIPTION'] = encounters['DESCRIPTION'].str.replace(' (procedure)', '')
 
-patients = encounters["PATIENT_ID"].unique()
+async def get_response(csv_data, limiter: RateLimiter, api_base: str = None, output_format: str = "json"):
+    if output_format == "json":
+        prompt, response_format = encounter_json_prompt, NotesResponse
+    else:
+        prompt, response_format = encounter_prompt, None
 
-@cache.memoize()
-def get_response(csv_data):
-    response = completion(
+    return await acompletion_with_retry(
+        limiter,
         model=model,
         messages=[
             {
                 "role": "user",
-                "content": encounter_prompt.format(csv_data=csv_data),
-                "temperature": .7,
-                "max_tokens": 1500
+                "content": prompt.format(csv_data=csv_data),
             }
         ],
+        response_format=response_format,
+        **request_params,
+        api_base=api_base,
     )
-    return response
-
-def compute_cost(response):
-    
-    print(response._hidden_params["response_cost"])
-    return response._hidden_params["response_cost"]
-     
-
-def extract_section(content, section_name):
-    start = content.find(f'```{section_name}')
-    end = content.find('```', start + len(f'```{section_name}'))
-    section = content[start + len(f'```{section_name}'):end]
-    # remove empty lines
-    section = section.split('\n')
-    section = [line for line in section if line.strip()]
-    section = '\n'.join(section)
-    return section
-
-# iterate through patients, get all of their encounters, and create a csv
-total_cost = 0
-encounter_max = 500
-for i in range(100, 150):
 
+
+def _parse_notes(response, prompt: PromptBatch, output_format: str) -> Optional[ParsedNotes]:
+    """Parse a response for prompt, or None (after reporting it) if it is invalid"""
     try:
-        batch = encounters[encounters['PATIENT_ID'] == patients[i]]
-        # Include only the first encounter_max encounters
-        first = batch.head(encounter_max)
-        # If there are more than encounter_max encounters, include the last encounter
-        if len(batch) > encounter_max:
-            last = batch.tail(1)
-            batch = pd.concat([first, last])
-            
-        batch_str = batch.to_csv(index=False)
-        print(batch_str)
-        
-        response = get_response(batch_str)
-        total_cost += compute_cost(response)
-        content = response['choices'][0]['message']['content']
-        
-        file_name = f"{output_path}/{patients[i]}.csv"
-        csv_section = extract_section(content, 'csv')
-        bio_section = extract_section(content, 'bio')
-        
+        return parse_response(response['choices'][0]['message']['content'] or '', prompt.encounter_ids(),
+                              prompt.patient_ids(), output_format)
+    except ValueError as e:
+        print(f"Invalid response for {len(prompt.chunks)} patients: {e}")
+        return None
+
+
+async def request_notes(prompt: PromptBatch, limiter: RateLimiter, costs: CostTracker, api_base: str = None,
+                        output_format: str = "json") -> ParsedNotes:
+    """
+    Get and validate the notes for a prompt
+
+    Responses are cached (see llm_cache.py) so re-running a prompt does not pay twice, but only
+    once they parse with a note for every encounter, so a re-run asks the model again for a
+    partial answer instead of replaying its gaps. An invalid response is reported with every
+    encounter missing.
+    """
+    csv_data = prompt.csv_data()
+    key = cache.key(model, prompt_versions[output_format], request_params, csv_data)
+    cached = cache.get(key)
+    if cached is not None:
+        parsed = _parse_notes(cached, prompt, output_format)
+        if parsed is not None and not parsed.missing:
+            return parsed
+
+    response = await get_response(csv_data, limiter, api_base, output_format)
+    costs.add(response)
+    parsed = _parse_notes(response, prompt, output_format)
+    if parsed is None:
+        return ParsedNotes(missing=set(prompt.encounter_ids()))
+    if not parsed.missing:
+        cache.set(key, response)
+    return parsed
+
+
+def patient_batches(encounters: pd.DataFrame, patient_indexes):
+    """
+    Yield (patient index, patient id, batch) for the requested patients in one pass
+
+    Patients are numbered in order of first appearance (as encounters['PATIENT_ID'].unique()
+    would). Each batch holds the first encounter_max encounters of the patient plus the
+    last one if there are more.
+    """
+    codes, _ = pd.factorize(encounters['PATIENT_ID'])
+    selected = np.isin(codes, np.fromiter(patient_indexes, dtype=np.int64))
+    wanted, codes = encounters[selected], codes[selected]
+
+    # Row position within each patient and the patient's encounter count, computed for all rows at once
+    position = wanted.groupby(codes, sort=False).cumcount().to_numpy()
+    size = np.bincount(codes)[codes]
+    keep = (position < encounter_max) | ((size > encounter_max) & (position == size - 1))
+
+    for i, batch in wanted[keep].groupby(codes[keep], sort=True):
+        yield int(i), batch['PATIENT_ID'].iat[0], batch
+
+
+class ResultWriter:
+    """
+    Writes per-patient files and buffers the combined all_encounters34.csv / all_bios.txt
+
+    The combined files are kept open and flushed every `flush_every` patients. Patients
+    are only recorded in the manifest after their rows have been flushed, so an
+    interrupted run never skips a patient whose output was lost.
+    """
+
+    def __init__(self, output_path: str, manifest: Manifest = None, flush_every: int = 50):
+        self.output_path = output_path
+        self.manifest = manifest
+        self.flush_every = flush_every
+        self.pending = []
+        self.encounters_file = open(f"{output_path}/all_encounters34.csv", 'a', buffering=1 << 20)
+        self.bios_file = open(f"{output_path}/all_bios.txt", 'a', buffering=1 << 20)
+
+    def write(self, i, patient_id, rows, bio):
+        """Write the (PATIENT_ID, ENCOUNTER_ID, CLINICAL_NOTES) rows and bio of one patient"""
+        out = io.StringIO()
+        csv.writer(out, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n').writerows(rows)
+        csv_rows = out.getvalue()
+
         # Write the individual files
-        with open(file_name, 'w') as f:
-            f.write(csv_section)
-        
-        with open(f"{output_path}/{patients[i]}.txt", 'w') as f:
-            f.write(bio_section) 
-            
-        # Write the csv to one file
-        with open(f"{output_path}/all_encounters34.csv", 'a') as f:
-            
-            # Remove header row
-            csv_section_list = csv_section.split('\n')[1:]
-            csv_section_str = '\n'.join(csv_section_list)
-            f.write(csv_section_str + '\n')
-        
-        # Write the bio to one file
-        with open(f"{output_path}/all_bios.txt", 'a') as f:
-            f.write(f'{i},"{bio_section}"\n')
-        
-    except Exception as e:
-        print(f"Error processing patient {patients[i]}: {e}")
-        traceback.print_exc()
-        
-    
-print(f"Total cost: {total_cost}")
+        with open(f"{self.output_path}/{patient_id}.csv", 'w') as f:
+            f.write('PATIENT_ID,ENCOUNTER_ID,CLINICAL_NOTES\n' + csv_rows)
+
+        with open(f"{self.output_path}/{patient_id}.txt", 'w') as f:
+            f.write(bio)
+
+        # Write the csv rows and the bio to the combined files
+        self.encounters_file.write(csv_rows)
+        self.bios_file.write(f'{i},"{bio}"\n')
+
+        self.pending.append(patient_id)
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.encounters_file.flush()
+        self.bios_file.flush()
+        if self.manifest is not None:
+            for patient_id in self.pending:
+                self.manifest.mark_done(patient_id)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.encounters_file.close()
+        self.bios_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def generate_notes(encounters: pd.DataFrame, patient_indexes, limiter: RateLimiter, manifest: Manifest,
+                         costs: CostTracker, concurrency: int, api_base: str = None, flush_every: int = 50,
+                         token_budget: int = 8000, output_format: str = "json", max_repairs: int = 2,
+                         output_path: str = output_path):
+    """
+    Generate notes for the given patients concurrently, skipping those already in the manifest
+
+    Encounters that come back without a note are re-requested on their own, up to
+    max_repairs times. Patients still missing notes after that are not written and
+    are returned with the failed ones so the next run picks them up.
+    """
+    batches = (batch for batch in patient_batches(encounters, patient_indexes) if batch[1] not in manifest)
+    prompts = pack_patients(batches, token_budget=token_budget, model=model)
+    print(f"Packed {sum(len(prompt.chunks) for prompt in prompts)} patient chunks into {len(prompts)} requests")
+
+    # Notes collected per patient until every chunk of a split patient has come back
+    collected = {}
+    incomplete = []
+
+    with ResultWriter(output_path, manifest, flush_every) as writer:
+        async def worker(prompt_id, prompt: PromptBatch):
+            parsed = await request_notes(prompt, limiter, costs, api_base, output_format)
+            for _ in range(max_repairs):
+                if not parsed.missing:
+                    break
+                print(f"Request {prompt_id}: re-requesting {len(parsed.missing)} missing notes")
+                repair = await request_notes(prompt.subset(parsed.missing), limiter, costs, api_base, output_format)
+                parsed.notes.update(repair.notes)
+                parsed.bios = {**repair.bios, **parsed.bios}
+                parsed.missing = repair.missing
+            print(f"Request {prompt_id} ({len(prompt.chunks)} patients) done, total ${costs.total_cost:.4f}")
+
+            # File writes happen between awaits, so concurrent workers never interleave lines
+            for chunk in prompt.chunks:
+                patient = collected.setdefault(chunk.patient_id, {'rows': [], 'bio': '', 'parts': 0, 'missing': 0})
+                patient['rows'] += [(chunk.patient_id, encounter_id, parsed.notes[encounter_id])
+                                    for encounter_id in chunk.rows['ENCOUNTER_ID'] if encounter_id in parsed.notes]
+                patient['missing'] += len(parsed.missing.intersection(chunk.rows['ENCOUNTER_ID']))
+                patient['bio'] = parsed.bios.get(chunk.patient_id, patient['bio'])
+                patient['parts'] += 1
+                if patient['parts'] == chunk.parts:
+                    del collected[chunk.patient_id]
+                    if patient['missing']:
+                        print(f"Patient {chunk.patient_id}: {patient['missing']} encounters still without notes")
+                        incomplete.append(chunk.patient_id)
+                    else:
+                        writer.write(chunk.patient_index, chunk.patient_id, patient['rows'], patient['bio'])
+
+        # The writer marks patients done once flushed, so run_jobs gets no manifest
+        failed = await run_jobs(enumerate(prompts), worker, concurrency=concurrency)
+    return incomplete + [patient_id for prompt_id in failed for patient_id in prompts[prompt_id].patient_ids()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate clinical notes for patient encounters")
+    parser.add_argument("--input", default=path, help="Encounters csv or parquet written by convert_synthea.py")
+    parser.add_argument("--start", type=int, default=100, help="First patient index")
+    parser.add_argument("--end", type=int, default=150, help="Last patient index (exclusive)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Tokens per minute limit")
+    parser.add_argument("--model", default=model)
+    parser.add_argument("--api-base", default=None, help="e.g. http://localhost:8089 for stub_llm_server.py")
+    parser.add_argument("--output", default=output_path, help="Directory for the per-patient and combined note files")
+    parser.add_argument("--manifest", default=None,
+                        help="Finished patients, for resuming (default: manifest.jsonl in --output)")
+    parser.add_argument("--flush-every", type=int, default=50, help="Patients between flushes of the combined files")
+    parser.add_argument("--token-budget", type=int, default=8000,
+                        help="Prompt plus expected response tokens per request when packing patients")
+    parser.add_argument("--output-format", choices=["json", "csv"], default="json",
+                        help="json uses structured output; csv parses the fenced csv/bio blocks")
+    parser.add_argument("--max-repairs", type=int, default=2, help="Times to re-request encounters missing a note")
+    parser.add_argument("--cache", default=None,
+                        help="Response cache directory or SQLAlchemy URL (default $LLM_CACHE or ~/.cache/genai-workshop/llm)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Cache size limit in MB")
+    args = parser.parse_args()
+
+    model = args.model
+    cache = LLMCache(args.cache, size_limit=args.cache_size * 2 ** 20)
+    costs = CostTracker()
+    os.makedirs(args.output, exist_ok=True)
+    failed = asyncio.run(generate_notes(
+        load_encounters(args.input),
+        range(args.start, args.end),
+        RateLimiter(rpm=args.rpm, tpm=args.tpm),
+        Manifest(args.manifest or os.path.join(args.output, 'manifest.jsonl')),
+        costs,
+        args.concurrency,
+        args.api_base,
+        args.flush_every,
+        args.token_budget,
+        args.output_format,
+        args.max_repairs,
+        args.output,
+    ))
+
+    if failed:
+        print(f"Failed patients (re-run to retry): {failed}")
+    print(f"Total cost: {costs.total_cost} ({costs})")
+    print(f"LLM cache ({cache.location}): {cache.stats}")
@@ -1,62 +1,196 @@
+import argparse
+import asyncio
+import os
+from typing import List
+
 import pandas as pd
-from litellm import completion
 import dotenv
+from pydantic import BaseModel
+
+from encounter_io import read_encounters
+from llm_batch import CostTracker, Manifest, RateLimiter, acompletion_with_retry, run_jobs
+from llm_cache import LLMCache
+from note_parsing import normalize_id
+from prompt_packing import PromptBatch, pack_patients
 
 dotenv.load_dotenv()
 
-path = "/Users/psulin/repos/genai-workshop-READY2025/data/1000_patients_encounters/patient_encounters.csv"
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+path = os.path.join(data_dir, '1000_patients_encounters', 'patient_encounters.csv')
+output_path = os.path.join(data_dir, 'bios')
 model = "gpt-4.1-mini"
+# Shared response cache, set in __main__ (see llm_cache.py)
+cache = None
+# Bump whenever bio_prompt changes so cached responses are not reused
+bio_prompt_version = "bio-2"
+request_params = {"temperature": 1}
+
+# Rough response tokens for one 1-2 paragraph bio, used when packing patients into requests
+bio_tokens = 350
 
 bio_prompt = """
 Generate a patient bio for each patient. First create a name for the patient and then write a bio. The bio should include these components:
 demographics(urban, rural, suburban), socio-economic status, types of travel they used, family structure and relations, social support, and how these
-things impact what the patient eats, and their levels of exercise, stress, and sleep. 
+things impact what the patient eats, and their levels of exercise, stress, and sleep.
 This should be in the form of a story, not a list of facts or generic descriptions, but personal and unique. It should be 1-2 paragraphs in length.
-Respond in csv format. Vary the stories for each patient along all components. Don't make them all have wonderful lives - be realistic.
+Return one entry in bios for every patient, with its PATIENT_ID exactly as given. Vary the stories for each patient along all components. Don't make them all have wonderful lives - be realistic.
 
-patients: 
+patients:
+```csv
 {patients}
+```
 """
 
-df = pd.read_csv(path)
-patients = df[["PATIENT_ID", "BIRTHDATE"]].groupby("PATIENT_ID").first()
 
-# Calculate age
-patients['AGE'] = (pd.Timestamp.now() - pd.to_datetime(patients['BIRTHDATE'])).dt.days / 365.25
-patients['AGE'] = patients['AGE'].astype(int)
-patients['AGE'] = patients['AGE'].clip(upper=103)
+class PatientStory(BaseModel):
+    patient_id: str
+    name: str
+    bio: str
+
+
+class BiosResponse(BaseModel):
+    """Schema sent as response_format"""
+    bios: List[PatientStory]
+
+
+def load_patients(path: str) -> pd.DataFrame:
+    df = read_encounters(path, columns=["PATIENT_ID", "BIRTHDATE"])
+    patients = df.groupby("PATIENT_ID", sort=False).first().reset_index()
 
-patients.info()
-print(patients.head())
+    # Calculate age
+    patients['AGE'] = (pd.Timestamp.now() - pd.to_datetime(patients['BIRTHDATE'])).dt.days / 365.25
+    patients['AGE'] = patients['AGE'].astype(int)
+    patients['AGE'] = patients['AGE'].clip(upper=103)
+    return patients
 
-# print(patients.head())
-def get_patient_bio(patients):
-    response = completion(
+
+async def get_patient_bio(patients: str, limiter: RateLimiter, api_base: str = None):
+    return await acompletion_with_retry(
+        limiter,
         model=model,
         messages=[
             {
                 "role": "user",
                 "content": bio_prompt.format(patients=patients),
-                "temperature": 1
             }
         ],
+        response_format=BiosResponse,
+        api_base=api_base,
+        **request_params,
     )
-    return response
-
-def compute_cost(response):
-    cost = response['usage']['total_tokens'] / 1000 * 0.0001
-    print(f"Cost: ${cost}")
-
-set_size = 2
-# iterate through patients in sets of set_size
-for i in range(0, len(patients), set_size):
-    batch = patients.iloc[i:i+set_size]
-    batch['bio'] = ''
-    # convert into csv formatted string but not a csv file
-    batch_str = batch.to_csv()
-    print(batch_str)
-    break
-    response = get_patient_bio(batch_str)
-    compute_cost(response)
-    print(response['choices'][0]['message']['content'])
-    break
+
+
+def _parse_bios(response, prompt: PromptBatch) -> dict:
+    """The valid bios in a response as {patient id: PatientStory}, empty (after reporting it) if it is invalid"""
+    try:
+        stories = BiosResponse.model_validate_json(response['choices'][0]['message']['content'] or '').bios
+    except ValueError as e:
+        print(f"Invalid response for {len(prompt.chunks)} patients: {e}")
+        return {}
+    expected = {normalize_id(patient_id): patient_id for patient_id in prompt.patient_ids()}
+    return {expected[normalize_id(story.patient_id)]: story for story in stories
+            if normalize_id(story.patient_id) in expected and story.bio.strip()}
+
+
+async def request_bios(prompt: PromptBatch, limiter: RateLimiter, costs: CostTracker, api_base: str = None) -> dict:
+    """
+    Get the bios for a prompt as {patient id: PatientStory}
+
+    Responses are cached (see llm_cache.py) only once they validate with a bio for every
+    patient, so a partial answer is requested again instead of replayed from the cache.
+    An invalid response returns no bios.
+    """
+    patients = prompt.csv_data()
+    key = cache.key(model, bio_prompt_version, request_params, patients)
+    cached = cache.get(key)
+    if cached is not None:
+        stories = _parse_bios(cached, prompt)
+        if len(stories) == len(prompt.chunks):
+            return stories
+
+    response = await get_patient_bio(patients, limiter, api_base)
+    costs.add(response)
+    stories = _parse_bios(response, prompt)
+    if len(stories) == len(prompt.chunks):
+        cache.set(key, response)
+    return stories
+
+
+async def generate_bios(patients: pd.DataFrame, limiter: RateLimiter, output: Manifest, costs: CostTracker,
+                        concurrency: int, api_base: str = None, token_budget: int = 6000, max_repairs: int = 2):
+    """
+    Generate bios for every patient not yet in the output file
+
+    Patients are packed into requests up to token_budget, and each bio is appended to the
+    output file (one JSON line per PATIENT_ID) as soon as its request returns, so an
+    interrupted run resumes with the remaining patients. Patients missing from a response
+    are re-requested on their own, up to max_repairs times.
+    """
+    batches = ((i, row.PATIENT_ID, patients.iloc[[i]]) for i, row in enumerate(patients.itertuples())
+               if row.PATIENT_ID not in output)
+    prompts = pack_patients(batches, token_budget=token_budget, model=model, note_tokens=bio_tokens)
+    print(f"Packed {sum(len(prompt.chunks) for prompt in prompts)} patients into {len(prompts)} requests")
+
+    async def worker(prompt_id, prompt: PromptBatch):
+        stories = await request_bios(prompt, limiter, costs, api_base)
+        for _ in range(max_repairs):
+            missing = [chunk for chunk in prompt.chunks if chunk.patient_id not in stories]
+            if not missing:
+                break
+            print(f"Request {prompt_id}: re-requesting {len(missing)} missing bios")
+            stories.update(await request_bios(PromptBatch(missing), limiter, costs, api_base))
+
+        for patient_id, story in stories.items():
+            output.mark_done(patient_id, name=story.name, bio=story.bio)
+        print(f"Request {prompt_id}: {len(stories)}/{len(prompt.chunks)} bios, total ${costs.total_cost:.4f}")
+        if len(stories) < len(prompt.chunks):
+            raise ValueError(f"{len(prompt.chunks) - len(stories)} patients still without a bio")
+
+    failed = await run_jobs(enumerate(prompts), worker, concurrency=concurrency)
+    return [patient_id for prompt_id in failed for patient_id in prompts[prompt_id].patient_ids()
+            if patient_id not in output]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate patient bios")
+    parser.add_argument("--input", default=path, help="Patient encounters csv or parquet with PATIENT_ID and BIRTHDATE")
+    parser.add_argument("--output", default=f"{output_path}/bios.jsonl",
+                        help="JSON lines file of bios keyed by PATIENT_ID; existing patients are skipped")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N patients")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Tokens per minute limit")
+    parser.add_argument("--model", default=model)
+    parser.add_argument("--api-base", default=None, help="e.g. http://localhost:8089 for stub_llm_server.py")
+    parser.add_argument("--token-budget", type=int, default=6000,
+                        help="Prompt plus expected response tokens per request when packing patients")
+    parser.add_argument("--max-repairs", type=int, default=2, help="Times to re-request patients missing a bio")
+    parser.add_argument("--cache", default=None,
+                        help="Response cache directory or SQLAlchemy URL (default $LLM_CACHE or ~/.cache/genai-workshop/llm)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Cache size limit in MB")
+    args = parser.parse_args()
+
+    model = args.model
+    cache = LLMCache(args.cache, size_limit=args.cache_size * 2 ** 20)
+    patients = load_patients(args.input)
+    if args.limit:
+        patients = patients.head(args.limit)
+    print(f"{len(patients)} patients")
+
+    costs = CostTracker()
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    failed = asyncio.run(generate_bios(
+        patients,
+        RateLimiter(rpm=args.rpm, tpm=args.tpm),
+        Manifest(args.output, key="PATIENT_ID"),
+        costs,
+        args.concurrency,
+        args.api_base,
+        args.token_budget,
+        args.max_repairs,
+    ))
+
+    if failed:
+        print(f"Patients without a bio (re-run to retry): {failed}")
+    print(f"Total cost: {costs.total_cost} ({costs})")
+    print(f"LLM cache ({cache.location}): {cache.stats}")
@@ -0,0 +1,208 @@
+"""
+Helpers for running many LLM requests concurrently with litellm.
+
+- TokenBucket / RateLimiter: keep requests and tokens under the RPM/TPM limits
+- acompletion_with_retry: litellm.acompletion with exponential backoff on 429s
+- Manifest: append-only record of finished job ids so a run can be resumed
+- CostTracker: accumulates the litellm response_cost and token usage
+- run_jobs: fan jobs out with bounded concurrency, skipping finished ones
+"""
+
+import asyncio
+import functools
+import json
+import os
+import random
+import time
+from typing import Awaitable, Callable, Iterable, Optional, Tuple
+
+import litellm
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken encoding for a model, or None if tiktoken or its encoding files are unavailable"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model.split("/")[-1])
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str, model: str = "gpt-4.1-mini") -> int:
+    """Count tokens with tiktoken, falling back to ~4 characters per token"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` tokens are available and take them"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def consume(self, amount: float):
+        """Take (or with a negative amount, give back) tokens without waiting"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one model"""
+
+    def __init__(self, rpm: int = 500, tpm: int = 200_000):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    async def acquire(self, estimated_tokens: int):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(estimated_tokens)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the real usage is known"""
+        self.tokens.consume(actual_tokens - estimated_tokens)
+
+
+RETRYABLE_ERRORS = tuple(
+    error for error in (
+        getattr(litellm, "RateLimitError", None),
+        getattr(litellm, "Timeout", None),
+        getattr(litellm, "APIConnectionError", None),
+        getattr(litellm, "ServiceUnavailableError", None),
+        getattr(litellm, "InternalServerError", None),
+    ) if error is not None
+)
+
+
+def _retry_after(error) -> Optional[float]:
+    """Seconds from a Retry-After header on the error's response, if present"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def acompletion_with_retry(limiter: RateLimiter, max_retries: int = 6, base_delay: float = 1.0,
+                                 max_delay: float = 60.0, **kwargs):
+    """
+    Call litellm.acompletion under the rate limiter, retrying rate limits and
+    transient errors with exponential backoff and jitter
+    """
+    prompt = "".join(str(message.get("content", "")) for message in kwargs.get("messages", []))
+    estimated = estimate_tokens(prompt, kwargs.get("model", "")) + kwargs.get("max_tokens", 0)
+
+    for attempt in range(max_retries + 1):
+        await limiter.acquire(estimated)
+        try:
+            response = await litellm.acompletion(**kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = _retry_after(e) or min(max_delay, base_delay * 2 ** attempt)
+            delay *= random.uniform(0.8, 1.2)
+            print(f"{type(e).__name__}: retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+            continue
+
+        usage = response.get("usage") or {}
+        limiter.reconcile(estimated, usage.get("total_tokens", estimated))
+        return response
+
+
+class Manifest:
+    """Append-only JSON lines file of finished job ids, stored under `key` in each line"""
+
+    def __init__(self, path: str, key: str = "id"):
+        self.path = path
+        self.key = key
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        self.done.add(str(json.loads(line)[key]))
+
+    def __contains__(self, job_id) -> bool:
+        return str(job_id) in self.done
+
+    def mark_done(self, job_id, **info):
+        self.done.add(str(job_id))
+        with open(self.path, "a") as f:
+            f.write(json.dumps({self.key: str(job_id), **info}) + "\n")
+
+
+class CostTracker:
+    """Accumulates cost and token usage across responses"""
+
+    def __init__(self):
+        self.total_cost = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+
+    def add(self, response) -> float:
+        cost = (getattr(response, "_hidden_params", None) or {}).get("response_cost") or 0.0
+        usage = response.get("usage") or {}
+        self.total_cost += cost
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+        self.requests += 1
+        return cost
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.prompt_tokens} prompt + {self.completion_tokens} completion "
+                f"tokens, ${self.total_cost:.4f}")
+
+
+async def run_jobs(jobs: Iterable[Tuple[object, object]], worker: Callable[[object, object], Awaitable[None]],
+                   concurrency: int = 8, manifest: Optional[Manifest] = None):
+    """
+    Run `worker(job_id, payload)` for every job with at most `concurrency` in flight
+
+    Jobs already in the manifest are skipped; a job is marked done once its
+    worker returns without raising. Errors are printed and the job is left
+    for the next run.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = []
+
+    async def run(job_id, payload):
+        async with semaphore:
+            try:
+                await worker(job_id, payload)
+            except Exception as e:
+                print(f"Error processing {job_id}: {e!r}")
+                failed.append(job_id)
+                return
+            if manifest is not None:
+                manifest.mark_done(job_id)
+
+    await asyncio.gather(*(run(job_id, payload) for job_id, payload in jobs
+                           if manifest is None or job_id not in manifest))
+    return failed
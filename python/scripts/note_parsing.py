@@ -0,0 +1,160 @@
+"""
+Parsing and validation of generated clinical notes.
+
+Two response formats are supported:
+- json: the model is asked for a NotesResponse via response_format (structured
+  output), so the reply is validated against the schema instead of scraped
+- csv:  the fenced ```csv / ```bio blocks, read with a strict CSV parser that
+  rejects malformed rows instead of joining their fields
+
+Either way the result is checked against the ENCOUNTER_IDs that were sent;
+ids without a note are reported as missing so only those get re-requested.
+"""
+
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+
+class EncounterNote(BaseModel):
+    patient_id: str
+    encounter_id: str
+    clinical_note: str
+
+
+class PatientBio(BaseModel):
+    patient_id: str
+    bio: str
+
+
+class NotesResponse(BaseModel):
+    """Schema sent as response_format in json mode"""
+    notes: List[EncounterNote]
+    bios: List[PatientBio]
+
+
+@dataclass
+class ParsedNotes:
+    """Notes and bios keyed by the original ids, plus the encounter ids that got no note"""
+    notes: Dict[object, str] = field(default_factory=dict)
+    bios: Dict[object, str] = field(default_factory=dict)
+    missing: Set[object] = field(default_factory=set)
+
+
+def normalize_id(value) -> str:
+    """Compare ids as text: strip whitespace/quotes and turn 12.0 into 12"""
+    text = str(value).strip().strip('"\'').strip()
+    try:
+        number = float(text)
+        if number.is_integer():
+            return str(int(number))
+    except ValueError:
+        pass
+    return text
+
+
+def extract_block(content: str, name: str) -> str:
+    """Return the body of a closed ```name fenced block, raising ValueError if there is none"""
+    match = re.search(rf"```{name}[^\n]*\n(.*?)```", content, re.DOTALL)
+    if match is None:
+        raise ValueError(f"no closed ```{name} block in response")
+    return match.group(1)
+
+
+def _match_notes(pairs: Iterable[Tuple[object, str]], expected_ids: Iterable) -> Tuple[Dict[object, str], Set[object]]:
+    """Keep the (encounter id, note) pairs that answer an expected id with a non-empty note"""
+    expected = {normalize_id(encounter_id): encounter_id for encounter_id in expected_ids}
+    notes = {}
+    for encounter_id, note in pairs:
+        key = normalize_id(encounter_id)
+        if key in expected and note and note.strip():
+            notes[expected[key]] = note.strip()
+    return notes, set(expected.values()) - set(notes)
+
+
+def _match_bios(pairs: Iterable[Tuple[object, str]], patient_ids: Sequence) -> Dict[object, str]:
+    expected = {normalize_id(patient_id): patient_id for patient_id in patient_ids}
+    return {expected[normalize_id(patient_id)]: bio.strip()
+            for patient_id, bio in pairs if normalize_id(patient_id) in expected and bio.strip()}
+
+
+def parse_notes(csv_section: str, expected_ids: Iterable, strict: bool = False) -> Tuple[Dict[object, str], Set[object]]:
+    """
+    Map the CLINICAL_NOTES in a returned CSV block to the ENCOUNTER_IDs that were sent
+
+    In strict mode quoting errors raise ValueError and rows with the wrong number of
+    fields are dropped (their ids come back as missing). Otherwise an unquoted note
+    that spilled into extra columns is joined back together.
+
+    Returns:
+        Tuple of ({encounter id: note}, {encounter ids without a note}), using the original id values
+    """
+    try:
+        rows = [row for row in csv.reader(io.StringIO(csv_section.strip()), skipinitialspace=True, strict=strict)
+                if any(row)]
+    except csv.Error as e:
+        raise ValueError(f"malformed csv: {e}") from e
+
+    # Without a header, assume the requested PATIENT_ID,ENCOUNTER_ID,CLINICAL_NOTES layout
+    id_column, note_column, width = 1, 2, 3
+    if rows:
+        header = [column.strip().upper() for column in rows[0]]
+        if "ENCOUNTER_ID" in header:
+            width = len(header)
+            id_column = header.index("ENCOUNTER_ID")
+            note_column = header.index("CLINICAL_NOTES") if "CLINICAL_NOTES" in header else width - 1
+            rows = rows[1:]
+
+    pairs = []
+    for row in rows:
+        if len(row) <= max(id_column, note_column) or (strict and len(row) != width):
+            continue
+        # An unquoted note containing commas spills into extra columns (their following spaces were skipped)
+        note = ", ".join(row[note_column:]) if note_column == width - 1 else row[note_column]
+        pairs.append((row[id_column], note))
+    return _match_notes(pairs, expected_ids)
+
+
+def parse_bios(bio_section: str, patient_ids: Sequence) -> Dict[object, str]:
+    """Map `PATIENT_ID: bio` lines back to the patients that were sent; a lone patient may omit the prefix"""
+    pairs = [(key, bio) for key, separator, bio in (line.partition(":") for line in bio_section.splitlines())
+             if separator]
+    bios = _match_bios(pairs, patient_ids)
+    if not bios and len(patient_ids) == 1 and bio_section.strip():
+        bios[patient_ids[0]] = bio_section.strip()
+    return bios
+
+
+def parse_json_response(content: str, expected_ids: Iterable, patient_ids: Sequence) -> ParsedNotes:
+    """Validate a NotesResponse reply; raises ValueError if it does not match the schema"""
+    content = content.strip()
+    if content.startswith("```"):
+        content = extract_block(content, "")
+    try:
+        response = NotesResponse.model_validate_json(content)
+    except ValidationError as e:
+        raise ValueError(f"response does not match the notes schema: {e.error_count()} errors") from e
+
+    notes, missing = _match_notes(((note.encounter_id, note.clinical_note) for note in response.notes), expected_ids)
+    bios = _match_bios(((bio.patient_id, bio.bio) for bio in response.bios), patient_ids)
+    return ParsedNotes(notes, bios, missing)
+
+
+def parse_csv_response(content: str, expected_ids: Iterable, patient_ids: Sequence) -> ParsedNotes:
+    """Parse the fenced csv and bio blocks strictly; raises ValueError if the csv block is missing or malformed"""
+    notes, missing = parse_notes(extract_block(content, "csv"), expected_ids, strict=True)
+    try:
+        bios = parse_bios(extract_block(content, "bio"), patient_ids)
+    except ValueError:
+        bios = {}
+    return ParsedNotes(notes, bios, missing)
+
+
+def parse_response(content: str, expected_ids: Iterable, patient_ids: Sequence, output_format: str = "json") -> ParsedNotes:
+    if output_format == "json":
+        return parse_json_response(content, expected_ids, patient_ids)
+    return parse_csv_response(content, expected_ids, patient_ids)
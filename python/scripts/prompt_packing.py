@@ -0,0 +1,150 @@
+"""
+Token-aware packing of patient encounter batches into LLM prompts.
+
+- pack_patients: measures each patient's CSV rows with tiktoken and best-fit packs
+  several small patients into one prompt up to a token budget. Patients that do not
+  fit on their own are split into chunks; every chunk after the first starts with a
+  PRIOR row summarising the earlier encounters so the notes stay consistent.
+
+Responses are parsed and validated in note_parsing.py.
+"""
+
+import bisect
+from dataclasses import dataclass, field, replace
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from llm_batch import estimate_tokens
+
+SUMMARY_ID = "PRIOR"
+
+# Rough response cost per encounter note and per patient bio, in tokens
+NOTE_TOKENS = 80
+BIO_TOKENS = 120
+
+
+@dataclass
+class PatientChunk:
+    """All (or one part of) a patient's encounters"""
+    patient_index: int
+    patient_id: object
+    rows: pd.DataFrame
+    part: int = 1
+    parts: int = 1
+    summary: Optional[str] = None
+    tokens: int = 0
+
+    def frame(self) -> pd.DataFrame:
+        """The rows to send, with the PRIOR summary row first if there is one"""
+        if self.summary is None:
+            return self.rows
+        summary_row = {column: "" for column in self.rows.columns}
+        summary_row.update({"PATIENT_ID": self.patient_id, "ENCOUNTER_ID": SUMMARY_ID, "DESCRIPTION": self.summary})
+        return pd.concat([pd.DataFrame([summary_row]), self.rows], ignore_index=True)
+
+
+@dataclass
+class PromptBatch:
+    """Patient chunks sent together in one request"""
+    chunks: List[PatientChunk] = field(default_factory=list)
+    tokens: int = 0
+
+    def csv_data(self) -> str:
+        return pd.concat([chunk.frame() for chunk in self.chunks], ignore_index=True).to_csv(index=False)
+
+    def encounter_ids(self) -> list:
+        return [encounter_id for chunk in self.chunks for encounter_id in chunk.rows["ENCOUNTER_ID"]]
+
+    def patient_ids(self) -> list:
+        return [chunk.patient_id for chunk in self.chunks]
+
+    def subset(self, encounter_ids) -> "PromptBatch":
+        """The same prompt restricted to some encounters, e.g. to re-request missing notes"""
+        encounter_ids = set(encounter_ids)
+        chunks = []
+        for chunk in self.chunks:
+            rows = chunk.rows[chunk.rows["ENCOUNTER_ID"].isin(encounter_ids)]
+            if len(rows):
+                chunks.append(replace(chunk, rows=rows))
+        return PromptBatch(chunks)
+
+
+def summarize_encounters(rows: pd.DataFrame, limit: int = 5) -> str:
+    """One line describing earlier encounters, carried into the next chunk of a split patient"""
+    parts = [f"{len(rows)} earlier encounters"]
+    for column, label in (("DESCRIPTION", "visits"), ("DESCRIPTION_CONDITIONS", "conditions"),
+                          ("DESCRIPTION_MEDICATIONS", "medications"), ("DESCRIPTION_PROCEDURES", "procedures")):
+        if column in rows:
+            values = rows[column].dropna().astype(str)
+            values = values[values.str.strip() != ""].value_counts().index[:limit]
+            if len(values):
+                parts.append(f"{label}: {'; '.join(values)}")
+    return ". ".join(parts)
+
+
+def _row_tokens(rows: pd.DataFrame, model: str, note_tokens: int) -> List[int]:
+    """Approximate prompt + response tokens for each encounter row"""
+    text = rows.fillna("").astype(str)
+    lines = text.iloc[:, 0].str.cat(text.iloc[:, 1:], sep=",")
+    return [estimate_tokens(line, model) + note_tokens for line in lines]
+
+
+def split_patient(patient_index, patient_id, rows: pd.DataFrame, row_tokens: Sequence[int], budget: int,
+                  model: str) -> List[PatientChunk]:
+    """Split a patient's rows into chunks of at most `budget` tokens, each carrying a summary of the earlier rows"""
+    chunks = []
+    start = 0
+    while start < len(rows):
+        summary = summarize_encounters(rows.iloc[:start]) if start else None
+        used = BIO_TOKENS + (estimate_tokens(summary, model) if summary else 0)
+        end = start
+        while end < len(rows) and (end == start or used + row_tokens[end] <= budget):
+            used += row_tokens[end]
+            end += 1
+        chunks.append(PatientChunk(patient_index, patient_id, rows.iloc[start:end], summary=summary, tokens=used))
+        start = end
+
+    for part, chunk in enumerate(chunks, 1):
+        chunk.part, chunk.parts = part, len(chunks)
+    return chunks
+
+
+def pack_patients(batches: Iterable[Tuple[int, object, pd.DataFrame]], token_budget: int = 8000,
+                  model: str = "gpt-4.1-mini", note_tokens: int = NOTE_TOKENS) -> List[PromptBatch]:
+    """
+    Pack (patient index, patient id, rows) batches into prompts of at most `token_budget` tokens
+
+    The budget covers the CSV block plus the expected response (note_tokens per encounter and
+    a bio per patient). Chunks are placed with best fit: into the fullest prompt that still
+    has room, or a new one.
+    """
+    header_tokens = None
+    prompts: List[PromptBatch] = []
+    # Sorted (remaining tokens, prompt number) for best-fit lookups
+    room: List[Tuple[int, int]] = []
+
+    for patient_index, patient_id, rows in batches:
+        if header_tokens is None:
+            header_tokens = estimate_tokens(",".join(rows.columns), model)
+        capacity = token_budget - header_tokens
+        row_tokens = _row_tokens(rows, model, note_tokens)
+        total = BIO_TOKENS + sum(row_tokens)
+
+        if total <= capacity:
+            chunks = [PatientChunk(patient_index, patient_id, rows, tokens=total)]
+        else:
+            chunks = split_patient(patient_index, patient_id, rows, row_tokens, capacity, model)
+
+        for chunk in chunks:
+            position = bisect.bisect_left(room, (chunk.tokens, -1))
+            if position < len(room):
+                remaining, number = room.pop(position)
+            else:
+                prompts.append(PromptBatch(tokens=header_tokens))
+                remaining, number = capacity, len(prompts) - 1
+            prompts[number].chunks.append(chunk)
+            prompts[number].tokens += chunk.tokens
+            bisect.insort(room, (remaining - chunk.tokens, number))
+
+    return prompts
@@ -0,0 +1,110 @@
+"""
+Local OpenAI-compatible stub server for exercising the note generators
+without spending money.
+
+Answers POST /chat/completions (and /v1/chat/completions) with a canned
+clinical note for every ENCOUNTER_ID found in the prompt's csv block and a
+bio per patient (as json when a response_format is requested). A configurable
+fraction of requests gets HTTP 429 and of notes is dropped, so the retry and
+repair logic gets exercised.
+
+    python stub_llm_server.py --port 8089 --fail-rate 0.2 --drop-rate 0.05
+    python generate_encounter_notes.py --api-base http://localhost:8089 --model openai/gpt-4.1-mini
+"""
+
+import argparse
+import csv
+import io
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_notes(prompt: str, as_json: bool = False, drop_rate: float = 0.0) -> str:
+    """
+    Build a response with one note per encounter row in the prompt, as fenced csv/bio
+    blocks or as json matching note_parsing.NotesResponse. A `drop_rate` fraction of
+    the notes is left out.
+    """
+    start = prompt.find("```csv")
+    end = prompt.find("```", start + 6)
+    rows = list(csv.DictReader(io.StringIO(prompt[start + 6:end].strip()))) if start != -1 else []
+
+    notes = []
+    patients = []
+    for row in rows:
+        if row.get("PATIENT_ID") not in patients:
+            patients.append(row.get("PATIENT_ID"))
+        if row.get("ENCOUNTER_ID") not in (None, "PRIOR") and random.random() >= drop_rate:
+            notes.append((row.get("PATIENT_ID"), row["ENCOUNTER_ID"],
+                          f"Stub note for {row.get('DESCRIPTION', 'encounter')}."))
+
+    if as_json:
+        return json.dumps({
+            "notes": [{"patient_id": p, "encounter_id": e, "clinical_note": n} for p, e, n in notes],
+            "bios": [{"patient_id": patient, "name": f"Stub {patient}", "bio": "Stub patient bio."} for patient in patients],
+        })
+
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+    writer.writerow(["PATIENT_ID", "ENCOUNTER_ID", "CLINICAL_NOTES"])
+    writer.writerows(notes)
+    bios = "".join(f"{patient}: Stub patient bio.\n" for patient in patients)
+    return f"```csv\n{out.getvalue()}```\n\n```bio\n{bios}```"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+    drop_rate = 0.0
+    latency = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency)
+
+        if random.random() < self.fail_rate:
+            self._send(429, {"error": {"message": "Rate limit exceeded (stub)", "type": "rate_limit_error"}},
+                       {"Retry-After": "1"})
+            return
+
+        prompt = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+        content = fake_notes(prompt, as_json=bool(body.get("response_format")), drop_rate=self.drop_rate)
+        self._send(200, {
+            "id": f"stub-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        })
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="Fraction of requests answered with 429")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of notes left out of responses")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before answering")
+    args = parser.parse_args()
+
+    StubHandler.fail_rate = args.fail_rate
+    StubHandler.drop_rate = args.drop_rate
+    StubHandler.latency = args.latency
+    print(f"Stub LLM server on http://localhost:{args.port} (fail rate {args.fail_rate})")
+    ThreadingHTTPServer(("", args.port), StubHandler).serve_forever()
@@ -0,0 +1,98 @@
+"""
+Checks for llm_batch.py against stub_llm_server.py: retries on 429s, manifest
+resume and cost totals, without network access or API spend.
+
+    python -m pytest test_llm_batch.py
+"""
+
+import asyncio
+import os
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer
+
+# Use litellm's bundled model cost map instead of fetching it
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import litellm
+import pytest
+
+from llm_batch import CostTracker, Manifest, RateLimiter, acompletion_with_retry, run_jobs
+from stub_llm_server import StubHandler
+
+model = "gpt-4.1-mini"
+
+
+class CountingStubHandler(StubHandler):
+    """StubHandler answering 429 for a third of the requests, counting the statuses and usage it sends"""
+    fail_rate = 0.3
+    statuses = Counter()
+    usage = Counter()
+    lock = threading.Lock()
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        with self.lock:
+            self.statuses[status] += 1
+            self.usage.update({key: value for key, value in payload.get("usage", {}).items()})
+        super()._send(status, payload, headers)
+
+
+@pytest.fixture
+def api_base():
+    CountingStubHandler.statuses.clear()
+    CountingStubHandler.usage.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def make_worker(api_base: str, costs: CostTracker, calls: list, fail: set = frozenset()):
+    limiter = RateLimiter(rpm=6000, tpm=10_000_000)
+
+    async def worker(job_id, payload):
+        calls.append(job_id)
+        if job_id in fail:
+            raise RuntimeError("worker failure")
+        response = await acompletion_with_retry(
+            limiter, max_retries=10, model=model, api_base=api_base, api_key="stub",
+            messages=[{"role": "user", "content": f"```csv\nPATIENT_ID,ENCOUNTER_ID\n{payload},{job_id}\n```"}],
+        )
+        costs.add(response)
+
+    return worker
+
+
+def test_retries_resume_and_costs(api_base, tmp_path):
+    jobs = [(f"job{i}", f"patient{i}") for i in range(20)]
+    manifest_path = str(tmp_path / "manifest.jsonl")
+
+    # First run: one job fails in the worker, the 429s are retried
+    costs, calls = CostTracker(), []
+    failed = asyncio.run(run_jobs(jobs, make_worker(api_base, costs, calls, fail={"job3"}), concurrency=8,
+                                  manifest=Manifest(manifest_path)))
+    assert failed == ["job3"]
+    assert sorted(calls) == sorted(job_id for job_id, _ in jobs)
+
+    statuses = CountingStubHandler.statuses
+    assert statuses[200] == 19 == costs.requests
+    assert statuses[429] > 0, "the stub never answered 429, so no retry was exercised"
+
+    # Cost totals match the usage the stub reported, priced by litellm
+    assert costs.prompt_tokens == CountingStubHandler.usage["prompt_tokens"]
+    assert costs.completion_tokens == CountingStubHandler.usage["completion_tokens"]
+    prompt_cost, completion_cost = litellm.cost_per_token(model=model, prompt_tokens=costs.prompt_tokens,
+                                                          completion_tokens=costs.completion_tokens)
+    assert costs.total_cost == pytest.approx(prompt_cost + completion_cost)
+    assert costs.total_cost > 0
+
+    # Resume: a manifest read back from disk skips the 19 finished jobs
+    manifest = Manifest(manifest_path)
+    assert len(manifest.done) == 19 and "job3" not in manifest
+    resumed_costs, resumed_calls = CostTracker(), []
+    failed = asyncio.run(run_jobs(jobs, make_worker(api_base, resumed_costs, resumed_calls), concurrency=8,
+                                  manifest=manifest))
+    assert failed == []
+    assert resumed_calls == ["job3"]
+    assert resumed_costs.requests == 1 and statuses[200] == 20
+    assert "job3" in Manifest(manifest_path)
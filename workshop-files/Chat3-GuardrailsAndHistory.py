@@ -29,11 +29,15 @@ extractor = URLExtract()
 
 # Import our shared RAG module
 from rag_module import WorkshopRAG
+from rag_metrics import start_metrics_server
 
 # Initialize the RAG system
 @st.cache_resource
 def initialize_rag():
     """Initialize the RAG system (cached for performance)"""
+    # Optionally expose pipeline timings as Prometheus metrics
+    if os.getenv("RAG_METRICS_PORT"):
+        start_metrics_server(int(os.getenv("RAG_METRICS_PORT")))
     return WorkshopRAG(
         collection_name="case_reports",
         llm_model=LLM_MODEL,
@@ -110,7 +114,7 @@ if prompt := st.chat_input():
         # 🚀 NEW: Use the shared RAG module instead of duplicating logic
         try:
             # Query the RAG system with conversation chain for memory
-            resp, retrieved_contexts = rag_system.query(
+            resp, retrieved_contexts, trace = rag_system.query_with_trace(
                 question=prompt,
                 conversation_history=conversation_history,
                 use_conversation_chain=True,
@@ -122,6 +126,16 @@ if prompt := st.chat_input():
                 st.write("**Retrieved Contexts:**")
                 for i, context in enumerate(retrieved_contexts[:2]):  # Show first 2 contexts
                     st.write(f"Context {i+1}: {context[:200]}...")
+
+                # Show how long each stage of the RAG pipeline took
+                st.write("**Pipeline Timing:**")
+                st.table({
+                    "Stage": list(trace.stages.keys()),
+                    "Duration (ms)": [round(ms, 1) for ms in trace.stages.values()],
+                })
+                tokens_note = " (estimated)" if trace.tokens_estimated else ""
+                st.write(f"Total: {trace.total_ms:.0f} ms | Retrieved docs: {trace.retrieved_docs} | "
+                         f"Tokens{tokens_note}: {trace.prompt_tokens} prompt, {trace.completion_tokens} completion")
                 st.write("---")
             
         except Exception as e:
@@ -1,22 +1,17 @@
 # Import the Python libraries that will be used for this app.
 # Libraries of note:
 # Streamlit, a Python library that makes it easy to create and share beautiful, custom web apps for data science and machine learning.
-# ChatOpenAI, a class that provides a simple interface to interact with OpenAI's models.
-# LangGraph for building stateful, multi-actor applications with LLMs
+# LangGraph for building stateful, multi-actor applications with LLMs (the agent itself is in healthcare_agent.py)
+import time
+
+# Streamlit re-runs this script on every interaction; time each run for the sidebar
+script_start = time.perf_counter()
+
 import streamlit as st
-from langchain_openai import ChatOpenAI
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain_iris import IRISVector
-from langchain.tools import BaseTool
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
-from langgraph.checkpoint.memory import MemorySaver
-from typing import Annotated, Sequence, TypedDict
-import operator
-import requests
-import json
+import asyncio
+import os
+import uuid
 
 # Import dotenv, a module that provides a way to read environment variable files
 from dotenv import load_dotenv
@@ -24,6 +19,8 @@ from dotenv import load_dotenv
 load_dotenv(override=True)
 
 from utils import LLM_MODEL
+from healthcare_agent import (build_agent, count_message_tokens, HISTORY_TOKEN_BUDGET, MAX_AGENT_STEPS,
+                              TURN_TOKEN_BUDGET, TOOL_OUTPUT_MODE)
 
 # Define the IRIS connection
 username = "_SYSTEM"
@@ -35,152 +32,21 @@ namespace = "IRISAPP"
 # Create the connection string for the IRIS connection
 CONNECTION_STRING = f"iris://{username}:{password}@{hostname}:{port}/{namespace}"
 
-# Create an instance of embeddings
-embeddings = FastEmbedEmbeddings()
-
-# Define the healthcare collection in the IRIS vector store
-HEALTHCARE_COLLECTION_NAME = "case_reports"
-
-# Create an instance of IRISVector
-db2 = IRISVector(
-    embedding_function=embeddings,
-    dimension=384,
-    collection_name=HEALTHCARE_COLLECTION_NAME,
-    connection_string=CONNECTION_STRING,
-)
-
-# Define the state for our graph
-class AgentState(TypedDict):
-    messages: Annotated[Sequence[HumanMessage | AIMessage | ToolMessage], operator.add]
-
-# Vector Search Tool
-class VectorSearchTool(BaseTool):
-    name: str = "vector_search"
-    description: str = "Search the healthcare vector database for relevant case reports and medical information. Input should be a search query string."
-    
-    def _run(self, query: str) -> str:
-        """Search the vector database for relevant documents."""
-        try:
-            docs_with_score = db2.similarity_search_with_score(query)
-            
-            if not docs_with_score:
-                return "No relevant documents found in the vector database."
-            
-            results = []
-            for i, (doc, score) in enumerate(docs_with_score[:3]):
-                content = doc.page_content
-                results.append(f"Document {i+1} (relevance score: {score:.3f}):\n{content}\n")
-            
-            return "\n".join(results)
-        
-        except Exception as e:
-            return f"Error searching vector database: {str(e)}"
-
-# Email Tool
-class EmailTool(BaseTool):
-    name: str = "send_email"
-    description: str = "Send an email notification. Input should be a JSON string with keys: to, subject, html. User must provide an email address."
-    
-    def _run(self, input_data: str) -> str:
-        """Send an email using the provided API endpoint."""
-        try:
-            # Parse JSON input
-            try:
-                data = json.loads(input_data)
-            except json.JSONDecodeError:
-                # If not JSON, treat as simple message
-                data = {"message": input_data}
-            
-            if data.get("to","")=="":
-                return f"❌ Error sending email: recipient is required"
-
-            # Default values
-            email_data = {
-                "to": data.get("to", ""),
-                "subject": data.get("subject", "Message from Vector Search App"),
-                "message": data.get("message", ""),
-                "html": data.get("html", "")
-            }
-            
-            # Send POST request to the email API
-            url = "https://g7jisuypzsugoopz4in4yyqfza0igivb.lambda-url.ap-southeast-2.on.aws/"
-            headers = {'Content-Type': 'application/json'}
-            
-            response = requests.post(url, headers=headers, json=email_data, timeout=30)
-            
-            if response.status_code == 200:
-                return f"✅ Email sent successfully to {email_data['to']} with subject: '{email_data['subject']}'"
-            else:
-                return f"❌ Failed to send email. Status code: {response.status_code}"
-        
-        except Exception as e:
-            return f"❌ Error sending email: {str(e)}"
-
-# Initialize tools
-tools = [VectorSearchTool(), EmailTool()]
-tool_node = ToolNode(tools)
-
-# Create the prompt template
-prompt = ChatPromptTemplate.from_messages([
-    ("system", """You are a helpful healthcare assistant that can search medical database and send email notifications.
+# The thread id is all it takes to read a conversation back from the checkpointer, so it stays in
+# the session unless AGENT_RESUME_FROM_URL=1 opts in to keeping it in the URL (?thread=...), where
+# a reload or a restart resumes it but anyone the link is shared with can read it too
+RESUME_FROM_URL = os.environ.get("AGENT_RESUME_FROM_URL") == "1"
 
-Always search the database first when users ask for medical information.
-When sending emails, be professional and include relevant medical findings. You must confirm user's email address with the user if not provided.
-Remember the conversation context and refer to previous searches when appropriate."""),
-    MessagesPlaceholder(variable_name="messages"),
-])
+# The embedding model, vector store, LLM clients, tools, checkpointer and compiled graph are
+# built once per process and shared by all sessions, instead of on every rerun
+@st.cache_resource(show_spinner="Loading the agent...")
+def get_agent():
+    return build_agent(CONNECTION_STRING)
 
-# Initialize LLM
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-# Bind tools to LLM
-llm_with_tools = llm.bind_tools(tools)
-
-# Define the agent node
-def call_model(state: AgentState):
-    messages = state["messages"]
-    response = llm_with_tools.invoke(prompt.format_messages(messages=messages))
-    return {"messages": [response]}
-
-# Define conditional logic for routing
-def should_continue(state: AgentState):
-    messages = state["messages"]
-    last_message = messages[-1]
-    
-    # If LLM makes a tool call, continue to tools
-    if last_message.tool_calls:
-        return "tools"
-    # Otherwise, end the conversation
-    return END
-
-# Build the graph
-workflow = StateGraph(AgentState)
-
-# Add nodes
-workflow.add_node("agent", call_model)
-workflow.add_node("tools", tool_node)
-
-# Set entry point
-workflow.set_entry_point("agent")
-
-# Add conditional edges
-workflow.add_conditional_edges(
-    "agent",
-    should_continue,
-    {
-        "tools": "tools",
-        END: END,
-    }
-)
-
-# Add edge from tools back to agent
-workflow.add_edge("tools", "agent")
-
-# Initialize memory
-memory = MemorySaver()
-
-# Compile the graph
-app = workflow.compile(checkpointer=memory)
+agent = get_agent()
+app = agent.app
+memory = agent.memory
+router = agent.router
 
 # Streamlit UI
 st.header("🏥 READY 2025 Agentic Healthcare Assistant")
@@ -199,6 +65,12 @@ with st.sidebar:
     
     if st.button("🗑️ Clear History"):
         st.session_state.messages = []
+        # A fresh thread, so the checkpointed history is not carried over
+        if "thread_id" in st.session_state:
+            memory.delete_thread(st.session_state.thread_id)
+        st.session_state.thread_id = str(uuid.uuid4())
+        if RESUME_FROM_URL:
+            st.query_params["thread"] = st.session_state.thread_id
         st.success("Thread cleared!")
     
 
@@ -206,9 +78,25 @@ with st.sidebar:
     st.write("- *Find patients with lung diseases and email me details in HTML format*")
     st.write("- *Email me a summary of this chat*")
 
-# Initialize session state for messages
+    # Filled in at the end of the script
+    rerun_timing = st.empty()
+
+# One checkpointer thread per conversation, for the lifetime of the browser session
+# (or of the URL with RESUME_FROM_URL)
+if "thread_id" not in st.session_state:
+    st.session_state.thread_id = (RESUME_FROM_URL and st.query_params.get("thread")) or str(uuid.uuid4())
+    if RESUME_FROM_URL:
+        st.query_params["thread"] = st.session_state.thread_id
+
+# Initialize session state for messages, from the checkpoint when resuming a thread
 if "messages" not in st.session_state:
     st.session_state.messages = []
+    saved = app.get_state({"configurable": {"thread_id": st.session_state.thread_id}})
+    for msg in saved.values.get("messages", []):
+        if isinstance(msg, HumanMessage):
+            st.session_state.messages.append({"role": "user", "content": msg.content})
+        elif isinstance(msg, AIMessage) and msg.content and not msg.tool_calls:
+            st.session_state.messages.append({"role": "assistant", "content": msg.content})
 
 # Display conversation history
 for message in st.session_state.messages:
@@ -224,25 +112,19 @@ if user_input := st.chat_input("Ask about medical cases or request actions..."):
     st.chat_message("user").write(user_input)
     
     # Prepare thread configuration
-    config = {"configurable": {"thread_id": "thread_id"}}
+    # The recursion limit backs up the turn budget in call_model
+    config = {"configurable": {"thread_id": st.session_state.thread_id},
+              "recursion_limit": 2 * MAX_AGENT_STEPS + 4}
     
     with st.chat_message("assistant"):
         # Show processing status
         with st.status("🔄 Processing with Agentic AI...", expanded=False) as status:
             try:
-                # Convert session messages to LangChain format
-                messages = []
-                for msg in st.session_state.messages:
-                    if msg["role"] == "user":
-                        messages.append(HumanMessage(content=msg["content"]))
-                    else:
-                        messages.append(AIMessage(content=msg["content"]))
-                
-                # Create initial state
-                initial_state = {"messages": messages}
+                # The checkpointer already holds the thread's history, so only the new message is sent
+                initial_state = {"messages": [HumanMessage(content=user_input)]}
                 
-                # Run the graph
-                result = app.invoke(initial_state, config=config)
+                # Run the graph; in async mode the ToolNode runs the tool calls of one AIMessage concurrently
+                result = asyncio.run(app.ainvoke(initial_state, config=config))
                 
                 # Get the final response
                 final_message = result["messages"][-1]
@@ -265,13 +147,41 @@ if user_input := st.chat_input("Ask about medical cases or request actions..."):
             with st.expander("🔍 LangGraph Execution Details"):
                 st.write("**Graph Execution Flow:**")
                 
-                # Show the message flow
-                for i, msg in enumerate(result["messages"]):
+                # Show the message flow of this turn, from the new user message on
+                turn_start = max(i for i, msg in enumerate(result["messages"]) if isinstance(msg, HumanMessage))
+                turn_messages = result["messages"][turn_start:]
+                history_tokens = count_message_tokens(result["messages"])
+                st.write(f"History: {len(result['messages'])} messages, ~{history_tokens} tokens "
+                         f"(budget {HISTORY_TOKEN_BUDGET}){', plus a summary of earlier turns' if result.get('summary') else ''}")
+                tool_messages = {msg.tool_call_id: msg for msg in turn_messages if isinstance(msg, ToolMessage)}
+                tool_artifacts = [msg.artifact for msg in tool_messages.values() if msg.artifact]
+                if router is not None:
+                    routing = router.stats()
+                    st.write(f"Route: {result.get('route_intent')} → "
+                             f"{'vector_search directly' if result.get('route_direct') else 'LLM planner'} | "
+                             f"planner skipped on {routing['direct_turns']} of {routing['turns']} turns "
+                             f"({routing['skip_share']:.0%})")
+                st.write(f"Turn: {result.get('turn_steps', 0)}/{MAX_AGENT_STEPS} model calls, "
+                         f"~{result.get('turn_tokens', 0)} tokens (budget {TURN_TOKEN_BUDGET}), "
+                         f"tool output {sum(a.get('tokens', 0) for a in tool_artifacts)} tokens sent "
+                         f"of {sum(a.get('raw_tokens', 0) for a in tool_artifacts)} ({TOOL_OUTPUT_MODE})")
+                for i, msg in enumerate(turn_messages):
                     if hasattr(msg, 'tool_calls') and msg.tool_calls:
                         st.write(f"**Step {i+1}: Tool Calls**")
+                        timings = [tool_messages[call["id"]].artifact for call in msg.tool_calls
+                                   if call["id"] in tool_messages and tool_messages[call["id"]].artifact]
+                        first_start = min((timing["started"] for timing in timings), default=0.0)
                         for tool_call in msg.tool_calls:
                             st.write(f"- Tool: `{tool_call['name']}`")
                             st.write(f"- Input: `{tool_call['args']}`")
+                            timing = getattr(tool_messages.get(tool_call["id"]), "artifact", None)
+                            if timing:
+                                st.write(f"- Time: {timing['seconds']:.2f}s (started at +{timing['started'] - first_start:.2f}s), "
+                                         f"output {timing.get('tokens', 0)} tokens of {timing.get('raw_tokens', 0)}")
+                        if len(timings) > 1:
+                            wall = max(t["started"] + t["seconds"] for t in timings) - first_start
+                            st.write(f"- {len(timings)} calls in {wall:.2f}s wall time "
+                                     f"({sum(t['seconds'] for t in timings):.2f}s if run one after another)")
                     elif isinstance(msg, ToolMessage):
                         st.write(f"**Step {i+1}: Tool Result**")
                         st.write(f"- Content: {msg.content[:200]}...")
@@ -279,3 +189,6 @@ if user_input := st.chat_input("Ask about medical cases or request actions..."):
                         if msg.content and len(msg.content) > 10:
                             st.write(f"**Step {i+1}: Agent Response**")
                             st.write(f"- Response: {msg.content[:200]}...")
+
+rerun_timing.caption(f"Script run: {(time.perf_counter() - script_start) * 1000:.1f} ms "
+                     f"(agent built once in {agent.build_seconds:.1f}s)")
@@ -0,0 +1,341 @@
+"""
+Agent Checkpoint Module
+
+A LangGraph checkpointer that keeps conversation state in a SQL database
+instead of process memory (MemorySaver), so threads survive app restarts
+and are shared by every replica of the chat app.
+
+The database is any SQLAlchemy URL: sqlite:///agent_checkpoints.db for a
+single machine, or the IRIS connection string (iris://...) to keep the
+checkpoints next to the vector tables. Two tables are used:
+- agent_checkpoints: one row per checkpoint, with the serialized state
+- agent_checkpoint_writes: pending writes of the tasks of each checkpoint
+
+Storage stays bounded:
+- compaction: each put keeps only the newest `keep_last` checkpoints of
+  the thread (older ones are only needed for time travel)
+- retention: threads not updated for `ttl_seconds` are deleted, checked
+  at most every `purge_interval` seconds from put, or with
+  `python agent_checkpoint.py --url ... --ttl-hours 24`
+
+Thread state is loaded lazily: get_tuple reads one thread's latest
+checkpoint by key when a run starts, nothing is held in memory between runs.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+import sqlalchemy as sa
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+DEFAULT_KEEP_LAST = 20
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_PURGE_INTERVAL = 600
+
+
+def checkpoint_tables(metadata: sa.MetaData, schema: Optional[str] = None):
+    """The checkpoint and pending write tables"""
+    checkpoints = sa.Table(
+        "agent_checkpoints", metadata,
+        sa.Column("thread_id", sa.String(64), primary_key=True),
+        sa.Column("checkpoint_ns", sa.String(255), primary_key=True),
+        sa.Column("checkpoint_id", sa.String(64), primary_key=True),
+        sa.Column("parent_checkpoint_id", sa.String(64)),
+        sa.Column("checkpoint_type", sa.String(32)),
+        sa.Column("checkpoint", sa.LargeBinary),
+        sa.Column("metadata_type", sa.String(32)),
+        sa.Column("metadata", sa.LargeBinary),
+        sa.Column("updated_at", sa.Float, index=True),
+        schema=schema,
+    )
+    writes = sa.Table(
+        "agent_checkpoint_writes", metadata,
+        sa.Column("thread_id", sa.String(64), primary_key=True),
+        sa.Column("checkpoint_ns", sa.String(255), primary_key=True),
+        sa.Column("checkpoint_id", sa.String(64), primary_key=True),
+        sa.Column("task_id", sa.String(64), primary_key=True),
+        sa.Column("idx", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("channel", sa.String(255)),
+        sa.Column("value_type", sa.String(32)),
+        sa.Column("value", sa.LargeBinary),
+        sa.Column("task_path", sa.String(255)),
+        schema=schema,
+    )
+    return checkpoints, writes
+
+
+class SQLCheckpointSaver(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer on a SQLAlchemy engine (SQLite or IRIS)
+
+    Args:
+        engine: SQLAlchemy engine; the tables are created if missing
+        schema: Schema for the tables (e.g. "GenAI" on IRIS, None for SQLite)
+        keep_last: Checkpoints kept per thread and namespace after each put (None keeps all)
+        ttl_seconds: Threads idle for longer are deleted (None keeps them forever)
+        purge_interval: Minimum seconds between the expiry checks run from put
+    """
+
+    def __init__(self, engine: sa.Engine, schema: Optional[str] = None,
+                 keep_last: Optional[int] = DEFAULT_KEEP_LAST,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS,
+                 purge_interval: float = DEFAULT_PURGE_INTERVAL, serde=None):
+        super().__init__(serde=serde)
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must be at least 1")
+        self.engine = engine
+        self.keep_last = keep_last
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self.checkpoints, self.writes = checkpoint_tables(sa.MetaData(), schema)
+        self.checkpoints.metadata.create_all(engine)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "SQLCheckpointSaver":
+        return cls(sa.create_engine(url, pool_pre_ping=True), **kwargs)
+
+    # Reading
+
+    def _pending_writes(self, conn, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        w = self.writes
+        rows = conn.execute(
+            sa.select(w.c.task_id, w.c.channel, w.c.value_type, w.c.value)
+            .where(w.c.thread_id == thread_id, w.c.checkpoint_ns == checkpoint_ns,
+                   w.c.checkpoint_id == checkpoint_id)
+            .order_by(w.c.task_id, w.c.idx)
+        ).fetchall()
+        return [(task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in rows]
+
+    def _to_tuple(self, conn, row) -> CheckpointTuple:
+        thread_id, checkpoint_ns = row.thread_id, row.checkpoint_ns
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": row.checkpoint_id}},
+            checkpoint=self.serde.loads_typed((row.checkpoint_type, row.checkpoint)),
+            metadata=self.serde.loads_typed((row.metadata_type, row.metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": row.parent_checkpoint_id}}
+                if row.parent_checkpoint_id else None
+            ),
+            pending_writes=self._pending_writes(conn, thread_id, checkpoint_ns, row.checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """The requested checkpoint, or the thread's latest one (checkpoint ids sort by time)"""
+        c = self.checkpoints
+        configurable = config["configurable"]
+        query = sa.select(c).where(c.c.thread_id == configurable["thread_id"],
+                                   c.c.checkpoint_ns == configurable.get("checkpoint_ns", ""))
+        if checkpoint_id := get_checkpoint_id(config):
+            query = query.where(c.c.checkpoint_id == checkpoint_id)
+        else:
+            query = query.order_by(c.c.checkpoint_id.desc()).limit(1)
+        with self.engine.connect() as conn:
+            row = conn.execute(query).first()
+            return self._to_tuple(conn, row) if row is not None else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        """Checkpoints newest first; `filter` matches metadata keys"""
+        c = self.checkpoints
+        query = sa.select(c).order_by(c.c.thread_id, c.c.checkpoint_id.desc())
+        if config is not None:
+            configurable = config["configurable"]
+            query = query.where(c.c.thread_id == configurable["thread_id"])
+            if "checkpoint_ns" in configurable:
+                query = query.where(c.c.checkpoint_ns == configurable["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                query = query.where(c.c.checkpoint_id == checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            query = query.where(c.c.checkpoint_id < before_id)
+        # Metadata is serialized, so the filter is applied here and the limit after it
+        if limit is not None and not filter:
+            query = query.limit(limit)
+
+        results = []
+        with self.engine.connect() as conn:
+            for row in conn.execute(query):
+                item = self._to_tuple(conn, row)
+                if filter and any(item.metadata.get(key) != value for key, value in filter.items()):
+                    continue
+                results.append(item)
+                if limit is not None and len(results) >= limit:
+                    break
+        yield from results
+
+    # Writing
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_type, checkpoint_data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        key = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}
+        values = {
+            "parent_checkpoint_id": configurable.get("checkpoint_id"),
+            "checkpoint_type": checkpoint_type,
+            "checkpoint": checkpoint_data,
+            "metadata_type": metadata_type,
+            "metadata": metadata_data,
+            "updated_at": time.time(),
+        }
+        c = self.checkpoints
+        with self.engine.begin() as conn:
+            updated = conn.execute(
+                c.update().where(*(c.c[name] == value for name, value in key.items())).values(**values)
+            ).rowcount
+            if not updated:
+                conn.execute(c.insert().values(**key, **values))
+            if self.keep_last is not None:
+                self._compact(conn, thread_id, checkpoint_ns, self.keep_last)
+
+        if self.ttl_seconds is not None and time.monotonic() - self._last_purge >= self.purge_interval:
+            self._last_purge = time.monotonic()
+            self.purge_expired()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        """Store a task's writes; special channels (errors, interrupts) replace earlier ones, others are kept"""
+        configurable = config["configurable"]
+        key = {"thread_id": configurable["thread_id"], "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+               "checkpoint_id": configurable["checkpoint_id"], "task_id": task_id}
+        w = self.writes
+        where = [w.c[name] == value for name, value in key.items()]
+        with self.engine.begin() as conn:
+            existing = set(conn.execute(sa.select(w.c.idx).where(*where)).scalars())
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                value_type, data = self.serde.dumps_typed(value)
+                row = {"channel": channel, "value_type": value_type, "value": data, "task_path": task_path}
+                if idx not in existing:
+                    conn.execute(w.insert().values(**key, idx=idx, **row))
+                elif idx < 0:
+                    conn.execute(w.update().where(*where, w.c.idx == idx).values(**row))
+
+    # Retention
+
+    def _delete(self, conn, *conditions):
+        """Delete matching checkpoints and their writes (conditions on thread_id/checkpoint_ns/checkpoint_id)"""
+        c, w = self.checkpoints, self.writes
+        conn.execute(w.delete().where(*(condition(w) for condition in conditions)))
+        return conn.execute(c.delete().where(*(condition(c) for condition in conditions))).rowcount
+
+    def _compact(self, conn, thread_id: str, checkpoint_ns: str, keep_last: int) -> int:
+        c = self.checkpoints
+        oldest_kept = conn.execute(
+            sa.select(c.c.checkpoint_id)
+            .where(c.c.thread_id == thread_id, c.c.checkpoint_ns == checkpoint_ns)
+            .order_by(c.c.checkpoint_id.desc()).offset(keep_last - 1).limit(1)
+        ).scalar()
+        if oldest_kept is None:
+            return 0
+        return self._delete(conn, lambda t: t.c.thread_id == thread_id,
+                            lambda t: t.c.checkpoint_ns == checkpoint_ns,
+                            lambda t: t.c.checkpoint_id < oldest_kept)
+
+    def compact(self, keep_last: int = None) -> int:
+        """Keep only the newest keep_last checkpoints of every thread; returns the checkpoints deleted"""
+        keep_last = keep_last or self.keep_last or 1
+        c = self.checkpoints
+        deleted = 0
+        with self.engine.begin() as conn:
+            for thread_id, checkpoint_ns in conn.execute(
+                    sa.select(c.c.thread_id, c.c.checkpoint_ns).group_by(c.c.thread_id, c.c.checkpoint_ns)
+                    .having(sa.func.count() > keep_last)).fetchall():
+                deleted += self._compact(conn, thread_id, checkpoint_ns, keep_last)
+        return deleted
+
+    def purge_expired(self, ttl_seconds: float = None) -> int:
+        """Delete threads whose latest checkpoint is older than the TTL; returns the threads deleted"""
+        ttl_seconds = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        if ttl_seconds is None:
+            return 0
+        c = self.checkpoints
+        with self.engine.begin() as conn:
+            expired = conn.execute(
+                sa.select(c.c.thread_id).group_by(c.c.thread_id)
+                .having(sa.func.max(c.c.updated_at) < time.time() - ttl_seconds)
+            ).scalars().all()
+            for thread_id in expired:
+                self._delete(conn, lambda t: t.c.thread_id == thread_id)
+        return len(expired)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.engine.begin() as conn:
+            self._delete(conn, lambda t: t.c.thread_id == thread_id)
+
+    def prune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        if strategy not in ("keep_latest", "delete"):
+            raise ValueError(f"Unknown prune strategy {strategy!r}")
+        c = self.checkpoints
+        with self.engine.begin() as conn:
+            for thread_id in thread_ids:
+                if strategy == "delete":
+                    self._delete(conn, lambda t: t.c.thread_id == thread_id)
+                    continue
+                for (checkpoint_ns,) in conn.execute(
+                        sa.select(c.c.checkpoint_ns).where(c.c.thread_id == thread_id).distinct()).fetchall():
+                    self._compact(conn, thread_id, checkpoint_ns, 1)
+
+    # Async: the database drivers are blocking, so each call runs in a worker thread
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    async def aprune(self, thread_ids: Sequence[str], *, strategy: str = "keep_latest") -> None:
+        await asyncio.to_thread(self.prune, thread_ids, strategy=strategy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire and compact agent checkpoints (e.g. from cron)")
+    parser.add_argument("--url", default="sqlite:///agent_checkpoints.db", help="SQLAlchemy URL of the checkpoint database")
+    parser.add_argument("--schema", default=None, help="Schema of the checkpoint tables (e.g. GenAI on IRIS)")
+    parser.add_argument("--ttl-hours", type=float, default=DEFAULT_TTL_SECONDS / 3600,
+                        help="Delete threads idle for longer than this")
+    parser.add_argument("--keep-last", type=int, default=DEFAULT_KEEP_LAST, help="Checkpoints kept per thread")
+    args = parser.parse_args()
+
+    saver = SQLCheckpointSaver.from_url(args.url, schema=args.schema, keep_last=args.keep_last,
+                                        ttl_seconds=args.ttl_hours * 3600)
+    start = time.perf_counter()
+    threads = saver.purge_expired()
+    checkpoints = saver.compact()
+    print(f"Deleted {threads} expired threads and compacted away {checkpoints} checkpoints "
+          f"in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,204 @@
+"""
+Intent Router Module
+
+Decides, without an LLM call, whether a chat message is a plain search that
+can go straight to the vector search tool, or needs the LLM planner
+(emails, multi-step requests, follow-ups about earlier answers, chit-chat).
+
+The router embeds a few example messages per intent once, with the same
+embedding model the vector store already uses (FastEmbed in the workshop),
+and classifies a message by its cosine similarity to the closest examples.
+A message is only routed directly when "search" wins clearly (at least
+`threshold` similarity and `margin` ahead of the next intent) and it does
+not match ESCALATE_PATTERN (email, or a second step such as "then" or
+"compare"). Anything else is escalated, so a wrong guess costs at most the
+planner call that would have been made anyway.
+
+Compound requests are caught by the pattern rather than by example: a
+"multi_step" example such as "Find patients with lung diseases and email me
+details" embeds close to its plain search half, and took "Find patients
+with lung diseases" away from search.
+
+On the Chat7 sidebar prompts the planner is skipped for 1 of 3: the two
+that mention email always escalate, and "Search for trauma treatment
+cases" is itself a search example, so it scores 1.0 and goes direct
+unless another intent's example embeds within `margin` of it.
+
+    router = IntentRouter(embeddings)
+    decision = router.route("Search for trauma treatment cases")
+    decision.direct      # True: call vector_search without the planner
+    router.stats()       # share of turns that skipped the planner
+
+To check threshold and margin against the FastEmbed model, run
+
+    python intent_router.py
+
+which routes LABELLED_QUERIES and SIDEBAR_PROMPTS over a grid of both and
+prints the wrong direct routes, the missed skips and the sidebar skip share.
+"""
+
+import argparse
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List
+
+import numpy as np
+
+SEARCH = "search"
+
+DEFAULT_EXAMPLES: Dict[str, List[str]] = {
+    SEARCH: [
+        "Search for trauma treatment cases",
+        "Find case reports about pneumonia in children",
+        "Show me cases of lung disease",
+        "What treatments are reported for sepsis?",
+        "Look up patients with diabetes complications",
+        "Cases involving hip fractures in elderly patients",
+        "Are there any reports of allergic reactions to penicillin?",
+        "Find medical cases with chest pain and shortness of breath",
+        "Find patients with lung diseases",
+        "Which patients have heart disease?",
+    ],
+    "email": [
+        "Email me the details",
+        "Send this to john@example.com",
+        "Email me a summary of this chat",
+        "Did my email go out?",
+        "Send the results to my colleague by email",
+    ],
+    "conversation": [
+        "Tell me more about the second document",
+        "Can you summarize what we discussed so far?",
+        "What did you mean by that?",
+        "Thanks, that's helpful",
+        "Hello, what can you do?",
+        "Explain the first case in simpler terms",
+    ],
+}
+
+# Email and multi-step requests always go to the planner, whatever the embedding similarity says
+ESCALATE_PATTERN = re.compile(r"e-?mail|@|\bsend\b|\bmail\b"
+                              r"|\bthen\b|\bcompar|\bsummar|\bdiffer|\bprevious\b|\bearlier\b", re.IGNORECASE)
+
+# The example prompts in the Chat7 sidebar
+SIDEBAR_PROMPTS = [
+    "Search for trauma treatment cases",
+    "Find patients with lung diseases and email me details in HTML format",
+    "Email me a summary of this chat",
+]
+
+# Messages that are not examples, and whether they should skip the planner
+LABELLED_QUERIES = [
+    ("Find cases of kidney failure", True),
+    ("Search for fractures in children", True),
+    ("Show me reports about asthma treatment", True),
+    ("Patients with high blood pressure", True),
+    ("Any cases of meningitis?", True),
+    ("Look up case reports on COVID-19 pneumonia", True),
+    ("What complications are reported after knee surgery?", True),
+    ("Email the results to me", False),
+    ("Find asthma cases and then summarize the treatments", False),
+    ("Compare these with the earlier results", False),
+    ("What did the second case say?", False),
+    ("Explain that in simpler terms", False),
+    ("Thanks!", False),
+    ("Who are you?", False),
+]
+
+
+@dataclass
+class RouteDecision:
+    intent: str
+    score: float
+    margin: float
+    direct: bool
+
+
+class IntentRouter:
+    """
+    Embedding-based intent classifier for chat messages
+
+    Args:
+        embeddings: LangChain embeddings (embed_documents/embed_query), e.g. the vector store's FastEmbed
+        examples: Example messages per intent; must include "search"
+        threshold: Minimum cosine similarity to the closest search example for a direct route
+        margin: Minimum lead of "search" over the next best intent
+    """
+
+    def __init__(self, embeddings, examples: Dict[str, List[str]] = None, threshold: float = 0.7,
+                 margin: float = 0.05):
+        examples = examples or DEFAULT_EXAMPLES
+        if SEARCH not in examples:
+            raise ValueError(f"examples must include the {SEARCH!r} intent")
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.margin = margin
+        self.intents = list(examples)
+        texts = [text for intent in self.intents for text in examples[intent]]
+        self._labels = np.array([i for i, intent in enumerate(self.intents) for _ in examples[intent]])
+        self._vectors = self._normalize(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.direct_turns = 0
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def classify(self, text: str) -> Dict[str, float]:
+        """Similarity of text to the closest example of each intent"""
+        query = self._normalize(np.asarray(self.embeddings.embed_query(text), dtype=np.float32))
+        similarities = self._vectors @ query
+        return {intent: float(similarities[self._labels == i].max()) for i, intent in enumerate(self.intents)}
+
+    def decide(self, text: str, scores: Dict[str, float]) -> RouteDecision:
+        """Route a message given its classify() scores, without counting it"""
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, score = ranked[0]
+        margin = score - ranked[1][1] if len(ranked) > 1 else score
+        direct = (intent == SEARCH and score >= self.threshold and margin >= self.margin
+                  and not ESCALATE_PATTERN.search(text))
+        return RouteDecision(intent, score, margin, direct)
+
+    def route(self, text: str) -> RouteDecision:
+        """Classify a message and count whether it skips the planner"""
+        decision = self.decide(text, self.classify(text))
+        with self._lock:
+            self.turns += 1
+            self.direct_turns += decision.direct
+        return decision
+
+    def stats(self) -> dict:
+        """Turns routed so far, and the share that skipped the planner call"""
+        with self._lock:
+            return {"turns": self.turns, "direct_turns": self.direct_turns,
+                    "skip_share": self.direct_turns / self.turns if self.turns else 0.0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route the labelled queries over a grid of thresholds and margins")
+    parser.add_argument("--thresholds", default="0.6,0.65,0.7,0.75,0.8,0.85")
+    parser.add_argument("--margins", default="0,0.02,0.05,0.1")
+    args = parser.parse_args()
+
+    from langchain_community.embeddings import FastEmbedEmbeddings
+
+    router = IntentRouter(FastEmbedEmbeddings())
+    queries = LABELLED_QUERIES + [(text, None) for text in SIDEBAR_PROMPTS]
+    scores = {text: router.classify(text) for text, _ in queries}
+    for text, expected in queries:
+        decision = router.decide(text, scores[text])
+        print(f"{decision.intent:<13}{decision.score:.3f}  margin {decision.margin:.3f}  "
+              f"{'' if expected is None else 'search ' if expected else 'planner'}  {text}")
+
+    print(f"\n{'threshold':>9} {'margin':>6} {'wrong direct':>12} {'missed skips':>12} {'sidebar skips':>13}")
+    for threshold in map(float, args.thresholds.split(",")):
+        for margin in map(float, args.margins.split(",")):
+            router.threshold, router.margin = threshold, margin
+            direct = {text: router.decide(text, scores[text]).direct for text, _ in queries}
+            wrong = sum(direct[text] and not expected for text, expected in LABELLED_QUERIES)
+            missed = sum(expected and not direct[text] for text, expected in LABELLED_QUERIES)
+            sidebar = sum(direct[text] for text in SIDEBAR_PROMPTS)
+            print(f"{threshold:>9.2f} {margin:>6.2f} {wrong:>12} {missed:>12} {sidebar:>9} of {len(SIDEBAR_PROMPTS)}")
@@ -0,0 +1,288 @@
+"""
+IRIS Search Module
+
+SQL helpers for searching the IRIS vector tables used in the workshop:
+the LangChain IRISVector collections (e.g. case_reports) and the
+GenAI.encounters table with its five `_Vector` columns.
+
+The batch functions take N query vectors and return N top-k lists from a
+single SQL statement. The query vectors are passed in as a derived table
+that is joined against the vector table, and ROW_NUMBER() picks the top k
+per query, so the table is scanned once instead of once per query.
+"""
+
+import json
+from typing import Dict, List, Sequence, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+from langchain_core.documents import Document
+
+ENCOUNTERS_TABLE = "GenAI.encounters"
+EMBEDDING_DIMENSION = 384
+
+# Similarity alias -> vector column, as used in 6-TuningRetrieval.ipynb
+ENCOUNTER_VECTOR_FIELDS = {
+    "sim_notes": "CLINICAL_NOTES_Vector",
+    "sim_obs": "DESCRIPTION_OBSERVATIONS_Vector",
+    "sim_cond": "DESCRIPTION_CONDITIONS_Vector",
+    "sim_proc": "DESCRIPTION_PROCEDURES_Vector",
+    "sim_med": "DESCRIPTION_MEDICATIONS_Vector",
+}
+
+DEFAULT_WEIGHTS = {
+    "sim_notes": 0.25,
+    "sim_obs": 0.35,
+    "sim_cond": 0.1,
+    "sim_proc": 0.2,
+    "sim_med": 0.1,
+}
+
+ENCOUNTER_TEXT_FIELDS = [
+    "CLINICAL_NOTES",
+    "DESCRIPTION_OBSERVATIONS",
+    "DESCRIPTION_CONDITIONS",
+    "DESCRIPTION_PROCEDURES",
+    "DESCRIPTION_MEDICATIONS",
+]
+
+
+def to_vector_str(vector: Sequence[float]) -> str:
+    """Format a vector for TO_VECTOR()"""
+    return ",".join(str(float(x)) for x in vector)
+
+
+def _query_vectors_table(query_vectors: Sequence[Sequence[float]], dimension: int) -> Tuple[str, dict]:
+    """
+    Build a derived table with one row (qid, qv) per query vector
+
+    Returns:
+        Tuple of (sql fragment, bind parameters)
+    """
+    selects = []
+    params = {}
+    for qid, vector in enumerate(query_vectors):
+        selects.append(f"SELECT {qid} AS qid, TO_VECTOR(:q{qid}, FLOAT, {dimension}) AS qv")
+        params[f"q{qid}"] = to_vector_str(vector)
+    return " UNION ALL ".join(selects), params
+
+
+def _group_rows(rows, n_queries: int) -> List[list]:
+    """Split (qid, ...) rows into one list per query"""
+    grouped = [[] for _ in range(n_queries)]
+    for row in rows:
+        grouped[int(row[0])].append(row[1:])
+    return grouped
+
+
+def similarity_search_batch(engine, collection_name: str, query_vectors: Sequence[Sequence[float]],
+                            k: int = 4, dimension: int = EMBEDDING_DIMENSION) -> List[List[Tuple[Document, float]]]:
+    """
+    Search a LangChain IRISVector collection for many query vectors in one round trip
+
+    Args:
+        engine: SQLAlchemy engine connected to IRIS
+        collection_name: Name of the IRISVector collection (table)
+        query_vectors: The query embeddings
+        k: Number of documents to return per query
+        dimension: Embedding dimension
+
+    Returns:
+        One list of (Document, cosine similarity) per query, most similar first
+    """
+    if len(query_vectors) == 0:
+        return []
+
+    queries_sql, params = _query_vectors_table(query_vectors, dimension)
+    params["k"] = k
+    sql = text(f"""
+        SELECT qid, id, document, metadata, score
+        FROM (
+            SELECT
+                q.qid, t.id, t.document, t.metadata,
+                VECTOR_COSINE(t.embedding, q.qv) AS score,
+                ROW_NUMBER() OVER (PARTITION BY q.qid ORDER BY VECTOR_COSINE(t.embedding, q.qv) DESC) AS rnk
+            FROM "{collection_name}" t, ({queries_sql}) q
+        ) ranked
+        WHERE rnk <= :k
+        ORDER BY qid, rnk
+    """)
+
+    with engine.connect() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    results = []
+    for group in _group_rows(rows, len(query_vectors)):
+        docs = []
+        for doc_id, document, metadata, score in group:
+            try:
+                metadata = json.loads(metadata) if metadata else {}
+            except (TypeError, ValueError):
+                metadata = {"metadata": metadata}
+            docs.append((Document(page_content=document, metadata=metadata, id=str(doc_id)), float(score)))
+        results.append(docs)
+    return results
+
+
+def _weighted_score_sql(weights: Dict[str, float], query_vector_sql: str = "q.qv") -> str:
+    """Weighted sum of the per-field cosine similarities; missing vectors count as 0"""
+    return " + ".join(
+        f"COALESCE(VECTOR_COSINE({ENCOUNTER_VECTOR_FIELDS[name]}, {query_vector_sql}), 0) * {float(weight)}"
+        for name, weight in weights.items() if weight
+    )
+
+
+def weighted_encounter_search(engine, query_vector: Sequence[float], k: int = 5,
+                              weights: Dict[str, float] = None, table: str = ENCOUNTERS_TABLE,
+                              dimension: int = EMBEDDING_DIMENSION) -> pd.DataFrame:
+    """
+    Weighted multi-field search over GenAI.encounters for a single query vector
+
+    Returns:
+        DataFrame with ENCOUNTER_ID, the text fields and weighted_sim
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    score_sql = _weighted_score_sql(weights, f"TO_VECTOR(:search_vector, FLOAT, {dimension})")
+    sql = text(f"""
+        SELECT TOP {int(k)} ENCOUNTER_ID, {", ".join(ENCOUNTER_TEXT_FIELDS)}, ({score_sql}) AS weighted_sim
+        FROM {table}
+        ORDER BY weighted_sim DESC
+    """)
+
+    with engine.connect() as conn:
+        rows = conn.execute(sql, {"search_vector": to_vector_str(query_vector)}).fetchall()
+
+    df = pd.DataFrame(rows, columns=["ENCOUNTER_ID", *ENCOUNTER_TEXT_FIELDS, "weighted_sim"])
+    df["weighted_sim"] = pd.to_numeric(df["weighted_sim"], errors="coerce")
+    return df
+
+
+def weighted_encounter_search_batch(engine, query_vectors: Sequence[Sequence[float]], k: int = 5,
+                                    weights: Dict[str, float] = None, table: str = ENCOUNTERS_TABLE,
+                                    dimension: int = EMBEDDING_DIMENSION) -> List[pd.DataFrame]:
+    """
+    Weighted multi-field search over GenAI.encounters for many query vectors in one round trip
+
+    Args:
+        engine: SQLAlchemy engine connected to IRIS
+        query_vectors: The query embeddings (normalized)
+        k: Number of encounters to return per query
+        weights: Weight per similarity alias (see ENCOUNTER_VECTOR_FIELDS)
+        table: Table to search (defaults to GenAI.encounters)
+        dimension: Embedding dimension
+
+    Returns:
+        One DataFrame per query with ENCOUNTER_ID, the text fields and weighted_sim
+    """
+    if len(query_vectors) == 0:
+        return []
+    weights = weights or DEFAULT_WEIGHTS
+
+    queries_sql, params = _query_vectors_table(query_vectors, dimension)
+    params["k"] = k
+    score_sql = _weighted_score_sql(weights)
+    fields = ", ".join(f"e.{field}" for field in ENCOUNTER_TEXT_FIELDS)
+    sql = text(f"""
+        SELECT qid, ENCOUNTER_ID, {", ".join(ENCOUNTER_TEXT_FIELDS)}, weighted_sim
+        FROM (
+            SELECT
+                q.qid, e.ENCOUNTER_ID, {fields},
+                ({score_sql}) AS weighted_sim,
+                ROW_NUMBER() OVER (PARTITION BY q.qid ORDER BY ({score_sql}) DESC) AS rnk
+            FROM {table} e, ({queries_sql}) q
+        ) ranked
+        WHERE rnk <= :k
+        ORDER BY qid, rnk
+    """)
+
+    with engine.connect() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    columns = ["ENCOUNTER_ID", *ENCOUNTER_TEXT_FIELDS, "weighted_sim"]
+    results = []
+    for group in _group_rows(rows, len(query_vectors)):
+        df = pd.DataFrame(group, columns=columns)
+        df["weighted_sim"] = pd.to_numeric(df["weighted_sim"], errors="coerce")
+        results.append(df)
+    return results
+
+
+def hybrid_search(query, engine, model, top_n=5, vector_weight=0.7, keyword_weight=0.3,
+                  weights: Dict[str, float] = None, table: str = ENCOUNTERS_TABLE):
+    """
+    Hybrid vector + keyword search over GenAI.encounters (from 6-TuningRetrieval.ipynb)
+
+    Parameters:
+    - query: Search query string
+    - engine: SQLAlchemy engine with connection to InterSystems IRIS
+    - model: model for embeddings
+    - top_n: Number of results to return
+    - vector_weight: Weight for vector search results (0.0 to 1.0)
+    - keyword_weight: Weight for keyword search results (0.0 to 1.0)
+    - weights: Weight per similarity alias for the vector score
+    - table: Table to search (defaults to GenAI.encounters)
+    """
+    weights = weights or DEFAULT_WEIGHTS
+
+    # Step 1: Vector search, scored with the weighted multi-field similarity
+    vector_df = weighted_encounter_search(engine, model.encode(query, normalize_embeddings=True),
+                                          k=top_n * 2, weights=weights, table=table)
+    vector_df = vector_df.rename(columns={"weighted_sim": "vector_score"})
+
+    # Step 2: Keyword search (simple implementation)
+    keywords = [word.lower() for word in query.split() if len(word) > 3]
+    if not keywords:
+        keywords = [query.lower()]
+    keywords = [keyword.replace("'", "''") for keyword in keywords]
+
+    matches = [f"{field} LIKE '%{keyword}%'" for field in ENCOUNTER_TEXT_FIELDS for keyword in keywords]
+    keyword_sql = text(f"""
+        SELECT TOP {int(top_n * 2)}
+            ENCOUNTER_ID, {", ".join(ENCOUNTER_TEXT_FIELDS)},
+            ({" + ".join(f"(CASE WHEN {match} THEN 1 ELSE 0 END)" for match in matches)}) AS keyword_score
+        FROM {table}
+        WHERE {" OR ".join(matches)}
+        ORDER BY keyword_score DESC
+    """)
+    with engine.connect() as conn:
+        keyword_results = conn.execute(keyword_sql).fetchall()
+    keyword_df = pd.DataFrame(keyword_results, columns=["ENCOUNTER_ID", *ENCOUNTER_TEXT_FIELDS, "keyword_score"])
+    keyword_df["keyword_score"] = pd.to_numeric(keyword_df["keyword_score"], errors="coerce")
+
+    # Step 3: Normalize scores to 0-1 range
+    for df, column in ((vector_df, "vector_score"), (keyword_df, "keyword_score")):
+        max_score = df[column].max() if not df.empty else None
+        if pd.notnull(max_score) and max_score > 0:
+            df[f"{column}_norm"] = df[column] / max_score
+        else:
+            df[f"{column}_norm"] = df[column]
+
+    # Steps 4-5: Combine as the notebook does and return the top N results
+    return _combine_hybrid(vector_df, keyword_df, vector_weight, keyword_weight).head(top_n)
+
+
+def _combine_hybrid(vector_df: pd.DataFrame, keyword_df: pd.DataFrame, vector_weight: float,
+                    keyword_weight: float) -> pd.DataFrame:
+    """
+    The vector hits (with the keyword score of the same encounter, else 0) followed by the
+    keyword-only hits (vector score 0), sorted by hybrid score
+
+    This is the merge of 6-TuningRetrieval.ipynb without its per-row loop: the rows go into
+    the sort in the same order, so ties in hybrid_score come out the same way too.
+    """
+    keyword_scores = keyword_df.drop_duplicates("ENCOUNTER_ID").set_index("ENCOUNTER_ID")
+    combined = vector_df.copy()
+    for column in ("keyword_score", "keyword_score_norm"):
+        combined[column] = combined["ENCOUNTER_ID"].map(keyword_scores[column]).fillna(0)
+
+    keyword_only = keyword_df[~keyword_df["ENCOUNTER_ID"].isin(vector_df["ENCOUNTER_ID"])].copy()
+    keyword_only["vector_score"] = 0
+    keyword_only["vector_score_norm"] = 0
+    combined = pd.concat([combined, keyword_only], ignore_index=True)
+
+    for column in ("vector_score_norm", "keyword_score_norm"):
+        combined[column] = pd.to_numeric(combined[column], errors="coerce").fillna(0)
+    combined["hybrid_score"] = (
+        combined["vector_score_norm"] * vector_weight + combined["keyword_score_norm"] * keyword_weight
+    )
+    return combined.sort_values(by="hybrid_score", ascending=False)
@@ -0,0 +1,213 @@
+"""
+Notification Queue Module
+
+Outbound email queue for the agent's send_email tool, so a slow or failing
+email endpoint no longer holds up the chat turn.
+
+- enqueue() validates the message, gives it an id and returns immediately
+- a background worker thread drains the queue in batches (up to batch_size
+  messages, waiting at most batch_wait seconds for a batch to fill) and
+  posts each batch concurrently over a pooled requests.Session
+- failed posts (connection errors, 429 and 5xx) are retried with
+  exponential backoff by urllib3's Retry
+- status(message_id) reports queued / sending / sent / failed, with the
+  attempts, HTTP status and error; the last `history` messages are kept
+
+get_queue(url) returns one queue per endpoint and process, so Streamlit
+reruns reuse the same worker. To try it without sending real email:
+
+    python notification_queue.py --emails 50 --fail-rate 0.2 --latency 0.5
+"""
+
+import argparse
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+STATUSES = ("queued", "sending", "sent", "failed")
+
+
+class EmailQueue:
+    """
+    Queue of emails delivered by a background thread
+
+    Args:
+        url: Email API endpoint; takes one JSON message (to, subject, message, html) per POST
+        batch_size: Messages taken from the queue and posted concurrently per batch
+        batch_wait: Seconds the worker waits for a batch to fill once the first message arrives
+        max_retries: Retries per message for connection errors, 429 and 5xx responses
+        backoff: Backoff factor between retries (backoff * 2 ** retry seconds)
+        timeout: Seconds per HTTP request
+        history: Statuses kept for status() (oldest dropped first)
+    """
+
+    def __init__(self, url: str, batch_size: int = 8, batch_wait: float = 0.2, max_retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 30, history: int = 1000):
+        self.url = url
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.timeout = timeout
+        self.history = history
+
+        retry = Retry(total=max_retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=batch_size, max_retries=retry))
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=batch_size, max_retries=retry))
+        self._executor = ThreadPoolExecutor(max_workers=batch_size, thread_name_prefix="email")
+
+        self._queue = queue.Queue()
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="email-queue", daemon=True)
+        self._worker.start()
+
+    # Producer side
+
+    def enqueue(self, email: dict) -> str:
+        """Queue an email dict (to, subject, message, html) and return its message id"""
+        if not email.get("to"):
+            raise ValueError("recipient is required")
+        message_id = uuid.uuid4().hex[:12]
+        self._set(message_id, status="queued", to=email["to"], subject=email.get("subject", ""),
+                  attempts=0, status_code=None, error=None, queued_at=time.time(), sent_at=None)
+        self._queue.put((message_id, email))
+        return message_id
+
+    def status(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            status = self._statuses.get(message_id)
+            return dict(status) if status else None
+
+    def recent(self, limit: int = 10) -> list:
+        """The latest statuses, newest first"""
+        with self._lock:
+            return [dict(status, id=message_id)
+                    for message_id, status in itertools.islice(reversed(self._statuses.items()), limit)]
+
+    def stats(self) -> dict:
+        """Message counts per status, and the queue length"""
+        with self._lock:
+            counts = {name: 0 for name in STATUSES}
+            for status in self._statuses.values():
+                counts[status["status"]] += 1
+        counts["pending"] = self._queue.qsize()
+        return counts
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until every queued message is delivered or failed; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    # Worker side
+
+    def _set(self, message_id: str, **fields):
+        with self._lock:
+            self._statuses.setdefault(message_id, {}).update(fields)
+            self._statuses.move_to_end(message_id)
+            while len(self._statuses) > self.history:
+                self._statuses.popitem(last=False)
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _deliver(self, message_id: str, email: dict):
+        self._set(message_id, status="sending")
+        try:
+            response = self.session.post(self.url, json=email, timeout=self.timeout)
+            # urllib3 records the retries it made on the final response
+            retries = response.raw.retries.history if response.raw is not None and response.raw.retries else ()
+            attempts = len(retries) + 1
+            if response.status_code == 200:
+                self._set(message_id, status="sent", attempts=attempts, status_code=200, sent_at=time.time())
+            else:
+                self._set(message_id, status="failed", attempts=attempts, status_code=response.status_code,
+                          error=f"HTTP {response.status_code}")
+        except Exception as e:
+            self._set(message_id, status="failed", error=str(e))
+        finally:
+            self._queue.task_done()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Post the batch over the pooled connections and wait for it before taking the next one
+            list(self._executor.map(lambda item: self._deliver(*item), batch))
+
+
+@lru_cache(maxsize=None)
+def get_queue(url: str, **kwargs) -> EmailQueue:
+    """One EmailQueue (and worker thread) per endpoint and process"""
+    return EmailQueue(url, **kwargs)
+
+
+def _start_stub_server(port: int, fail_rate: float, latency: float):
+    """Local stand-in for the email API: 200 after `latency` seconds, or 503 for a `fail_rate` fraction"""
+    import json
+    import random
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            time.sleep(latency)
+            status = 503 if random.random() < fail_rate else 200
+            if status == 200:
+                received.append(body)
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliver test emails through the queue to a local stub endpoint")
+    parser.add_argument("--emails", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fail-rate", type=float, default=0.2, help="Fraction of posts answered with 503")
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds the stub takes per post")
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    server, received = _start_stub_server(args.port, args.fail_rate, args.latency)
+    email_queue = EmailQueue(f"http://127.0.0.1:{args.port}/", batch_size=args.batch_size, backoff=0.1)
+
+    start = time.perf_counter()
+    ids = [email_queue.enqueue({"to": f"user{i}@example.com", "subject": f"Test {i}", "html": "<p>test</p>"})
+           for i in range(args.emails)]
+    print(f"Enqueued {len(ids)} emails in {(time.perf_counter() - start) * 1000:.1f} ms")
+    email_queue.wait()
+    elapsed = time.perf_counter() - start
+    print(f"Delivered in {elapsed:.2f}s ({args.emails * args.latency:.2f}s one at a time without failures): "
+          f"{email_queue.stats()}, {len(received)} received by the stub")
+    print(f"Retried: {sum(email_queue.status(i)['attempts'] > 1 for i in ids)}")
+    server.shutdown()
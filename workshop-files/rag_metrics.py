@@ -0,0 +1,171 @@
+"""
+RAG Metrics Module
+
+Per-request instrumentation for the RAG pipeline in rag_module.py.
+
+Each call to WorkshopRAG.query records a QueryTrace with the duration of
+every stage (embed, vector search, prompt build, LLM call, post-processing),
+the prompt/completion token counts and the number of retrieved documents.
+
+Traces are exported to whichever backend is installed:
+- OpenTelemetry: a `rag.query` span with one child span per stage
+- Prometheus: histograms/counters served by `start_metrics_server(port)`
+
+Both packages are optional; without them traces are only kept in memory
+(returned by WorkshopRAG.query_with_trace) for display in the chat apps.
+"""
+
+import functools
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+try:
+    from opentelemetry import trace as otel_trace
+    _tracer = otel_trace.get_tracer("workshop.rag")
+except ImportError:
+    _tracer = None
+
+try:
+    import prometheus_client
+    STAGE_SECONDS = prometheus_client.Histogram(
+        "rag_stage_seconds", "Duration of each RAG pipeline stage", ["stage"]
+    )
+    TOKENS = prometheus_client.Counter(
+        "rag_tokens_total", "Prompt and completion tokens used by the RAG pipeline", ["kind"]
+    )
+    RETRIEVED_DOCS = prometheus_client.Histogram(
+        "rag_retrieved_docs", "Documents retrieved per query", buckets=(0, 1, 2, 4, 8, 16, 32)
+    )
+    TOOL_OUTPUT_TOKENS = prometheus_client.Histogram(
+        "agent_tool_output_tokens", "Tokens of agent tool results, before (raw) and after (sent) compaction",
+        ["tool", "kind"], buckets=(50, 100, 250, 500, 1000, 2500, 5000, 10000)
+    )
+except ImportError:
+    prometheus_client = None
+
+_metrics_server_started = False
+
+
+def start_metrics_server(port: int = 8000) -> bool:
+    """Serve Prometheus metrics on /metrics (once per process). Returns False if prometheus_client is missing"""
+    global _metrics_server_started
+    if prometheus_client is None:
+        return False
+    if not _metrics_server_started:
+        prometheus_client.start_http_server(port)
+        _metrics_server_started = True
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken encoding for a model, or None if tiktoken or its encoding files are unavailable"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Count tokens with tiktoken, falling back to a rough 4 characters per token estimate"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    """The first max_tokens tokens of text (about 4 characters per token without tiktoken)"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def record_tool_output(tool: str, raw_tokens: int, sent_tokens: int) -> None:
+    """Export the size of one agent tool result"""
+    if prometheus_client is not None:
+        TOOL_OUTPUT_TOKENS.labels(tool=tool, kind="raw").observe(raw_tokens)
+        TOOL_OUTPUT_TOKENS.labels(tool=tool, kind="sent").observe(sent_tokens)
+
+
+def token_usage(response) -> Optional[Dict[str, int]]:
+    """Read prompt/completion token counts from a LangChain chat model response, if reported"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return {"prompt_tokens": usage.get("input_tokens", 0), "completion_tokens": usage.get("output_tokens", 0)}
+
+    usage = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if usage:
+        return {"prompt_tokens": usage.get("prompt_tokens", 0), "completion_tokens": usage.get("completion_tokens", 0)}
+    return None
+
+
+@dataclass
+class QueryTrace:
+    """Timings (in milliseconds) and counters for a single RAG request"""
+    question: str
+    stages: Dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retrieved_docs: int = 0
+    tokens_estimated: bool = False
+    _span: object = field(default=None, repr=False)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.stages.values())
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage and export it as a child span"""
+        span = _tracer.start_as_current_span(f"rag.{name}") if _tracer else nullcontext()
+        start = time.perf_counter()
+        with span:
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed * 1000
+                if prometheus_client is not None:
+                    STAGE_SECONDS.labels(stage=name).observe(elapsed)
+
+    def finish(self) -> None:
+        """Export the counters once the request is complete"""
+        if self._span is not None:
+            self._span.set_attribute("rag.retrieved_docs", self.retrieved_docs)
+            self._span.set_attribute("rag.prompt_tokens", self.prompt_tokens)
+            self._span.set_attribute("rag.completion_tokens", self.completion_tokens)
+        if prometheus_client is not None:
+            TOKENS.labels(kind="prompt").inc(self.prompt_tokens)
+            TOKENS.labels(kind="completion").inc(self.completion_tokens)
+            RETRIEVED_DOCS.observe(self.retrieved_docs)
+
+    def as_dict(self) -> dict:
+        return {
+            "stages_ms": {name: round(ms, 1) for name, ms in self.stages.items()},
+            "total_ms": round(self.total_ms, 1),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "tokens_estimated": self.tokens_estimated,
+            "retrieved_docs": self.retrieved_docs,
+        }
+
+
+@contextmanager
+def trace_query(question: str):
+    """Create a QueryTrace wrapped in a `rag.query` span"""
+    span = _tracer.start_as_current_span("rag.query") if _tracer else nullcontext()
+    with span as current:
+        query_trace = QueryTrace(question=question, _span=current)
+        try:
+            yield query_trace
+        finally:
+            query_trace.finish()